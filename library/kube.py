@@ -18,7 +18,12 @@ options:
     required: false
     default: null
     description:
-      - The path and filename of the resource(s) definition file.
+      - The path and filename of the resource(s) definition file. A list of
+        files and directories (whose .json, .yaml and .yml files are used)
+        applies all of their objects at once, with one kubectl run or one
+        API connection, and reports every object in C(results).
+        state=stopped needs transport=api for several files, since kubectl
+        has no stop command any more.
   namespace:
     required: false
     default: null
@@ -38,7 +43,43 @@ options:
     required: false
     default: null
     description:
-      - The url for the API server that commands are executed against.
+      - The url for the API server that commands are executed against. With
+        transport=api it defaults to http://localhost:8080.
+  transport:
+    required: false
+    choices: ['kubectl', 'api']
+    default: kubectl
+    description:
+      - kubectl runs a kubectl process for every operation. api talks to the
+        API server directly and reuses one keep-alive connection for every
+        request of the task, which avoids the process start, kubeconfig
+        parsing and TLS handshake of each kubectl call.
+  api_token:
+    required: false
+    default: null
+    description:
+      - Bearer token to authenticate to the API server with (transport=api).
+  ca_cert:
+    required: false
+    default: null
+    description:
+      - CA certificate file to verify the API server with (transport=api).
+  client_cert:
+    required: false
+    default: null
+    description:
+      - Client certificate file to authenticate to the API server with
+        (transport=api).
+  client_key:
+    required: false
+    default: null
+    description:
+      - Key file for client_cert (transport=api).
+  validate_certs:
+    required: false
+    default: true
+    description:
+      - Whether to verify the API server's certificate (transport=api).
   force:
     required: false
     default: false
@@ -49,6 +90,24 @@ options:
     default: false
     description:
       - A flag to indicate delete all, stop all, or all namespaces when checking exists.
+  wait:
+    required: false
+    default: false
+    description:
+      - Wait until the created, updated or deleted resources are ready, or
+        gone. With transport=api this watches the resources over one
+        connection and understands pods, jobs, daemon sets and every
+        resource with replicas; with transport=kubectl it runs kubectl wait
+        and kubectl rollout status for pods, jobs, deployments, daemon sets
+        and stateful sets, in the namespace of their definition or else of
+        the task.
+  wait_timeout:
+    required: false
+    default: 300
+    description:
+      - How many seconds to wait for before failing. Also bounds the wait
+        for an object to be deleted before it is created again with
+        state=reloaded force=yes transport=api.
   log_level:
     required: false
     default: 0
@@ -61,11 +120,14 @@ options:
     description:
       - present handles checking existence or creating if definition file provided,
         absent handles deleting resource(s) based on other options,
-        latest handles creating ore updating based on existence,
+        latest compares the definition file with the live resource(s) and
+        creates or updates them with a server-side apply only when they
+        differ (kubectl diff with transport=kubectl),
         reloaded handles updating resource(s) definition using definition file,
         stopped handles stopping resource(s) based on other options.
 requirements:
-  - kubectl
+  - kubectl (transport=kubectl)
+  - PyYAML for YAML definition files (transport=api)
 author: "Kenny Jones (@kenjones-cisco)"
 """
 
@@ -81,33 +143,279 @@ EXAMPLES = """
 
 - name: test nginx is presen
   kube: filename=/tmp/nginx.yml
+
+- name: create or update every object of the addons
+  kube: state=latest
+  args:
+    filename:
+      - /etc/kubernetes/kube-system.yml
+      - /etc/kubernetes/addons
+
+- name: update nginx and wait for its pods to be ready
+  kube: filename=/tmp/nginx.yml state=latest wait=yes wait_timeout=120
+
+- name: test nginx is present, talking to the API server directly
+  kube:
+    filename: /tmp/nginx.yml
+    transport: api
+    server: https://10.0.0.1:6443
+    ca_cert: /etc/kubernetes/ca.pem
+    api_token: "{{ kube_token }}"
 """
 
+import errno  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import socket  # noqa: E402
+import time  # noqa: E402
+from contextlib import contextmanager  # noqa: E402
+
+try:
+    import http.client as httplib
+    from urllib.parse import quote, urlencode, urlparse
+except ImportError:  # python 2
+    import httplib
+    from urllib import quote, urlencode
+    from urlparse import urlparse
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# kubectl's short names, for API servers that do not list them
+KUBECTL_ALIASES = {
+    'cm': 'configmaps',
+    'cs': 'componentstatuses',
+    'deploy': 'deployments',
+    'ds': 'daemonsets',
+    'ep': 'endpoints',
+    'ev': 'events',
+    'hpa': 'horizontalpodautoscalers',
+    'ing': 'ingresses',
+    'limits': 'limitranges',
+    'no': 'nodes',
+    'ns': 'namespaces',
+    'po': 'pods',
+    'pv': 'persistentvolumes',
+    'pvc': 'persistentvolumeclaims',
+    'quota': 'resourcequotas',
+    'rc': 'replicationcontrollers',
+    'rs': 'replicasets',
+    'sa': 'serviceaccounts',
+    'svc': 'services',
+}
+
+DEFINITION_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+# "kind/name created" from current kubectl, 'kind "name" created' from older
+KUBECTL_RESULT = re.compile(r'^(?P<kind>[\w.-]+)(?:/|\s+")(?P<name>[^"\s]+)"?\s+'
+                            r'(?P<action>[\w-]+)')
+# 'Error from server (Reason): error when creating "file": kind "name" message',
+# or the last line of a failed apply, 'for: "file": kind "name" message'
+KUBECTL_ERROR = re.compile(r'(?:\((?P<reason>\w+)\): error when [^"]*|^for: )'
+                           r'"(?P<filename>[^"]+)": '
+                           r'(?P<kind>[\w.-]+) "(?P<name>[^"]+)" (?P<msg>.*)')
+
+# owner of the fields set by state=latest, see server-side apply
+FIELD_MANAGER = 'ansible-kube'
+APPLY_ARGS = ['--server-side', '--force-conflicts', '--field-manager=' + FIELD_MANAGER]
+
+# kubectl diff compares files named group.version.Kind.namespace.name
+KUBECTL_DIFF_TARGET = re.compile(r'^(?:.*?\.)?(?P<kind>[A-Z]\w*)\.(?P<namespace>[a-z0-9-]*)\.'
+                                 r'(?P<name>.+)$')
+
+# kubectl verb for each state when applying several definition files
+BULK_COMMANDS = {
+    'present': 'create',
+    'absent': 'delete',
+    'latest': 'apply',
+    'reloaded': 'replace',
+}
+
+
+# terms of a label selector, split on the commas outside of "in (a, b)"
+SELECTOR_TERM = re.compile(r',\s*(?![^()]*\))')
+SELECTOR_SET = re.compile(r'^(?P<key>[\w./-]+)\s+(?P<op>in|notin)\s+\((?P<values>[^()]*)\)$')
+SELECTOR_EQUALITY = re.compile(r'^(?P<key>[\w./-]+)\s*(?P<op>==|=|!=)\s*(?P<value>[\w.-]*)$')
+SELECTOR_EXISTS = re.compile(r'^(?P<op>!?)\s*(?P<key>[\w./-]+)$')
+SELECTOR_VALUE = re.compile(r'^[\w.-]*$')
+
+
+def parse_selector(selector):
+    """Parse a label selector into (key, operator, values) requirements,
+    raising ValueError for one kubectl would reject."""
+    requirements = []
+    for term in SELECTOR_TERM.split(selector.strip()):
+        term = term.strip()
+        match = SELECTOR_SET.match(term)
+        if match:
+            values = set(value.strip() for value in match.group('values').split(','))
+            if not all(SELECTOR_VALUE.match(value) for value in values):
+                raise ValueError('invalid label selector %r' % selector)
+            requirements.append((match.group('key'), match.group('op'), values))
+            continue
+        match = SELECTOR_EQUALITY.match(term)
+        if match:
+            op = '!=' if match.group('op') == '!=' else 'in'
+            requirements.append((match.group('key'), op, set([match.group('value')])))
+            continue
+        match = SELECTOR_EXISTS.match(term)
+        if match is None:
+            raise ValueError('invalid label selector %r' % selector)
+        requirements.append((match.group('key'), '!' if match.group('op') else 'exists',
+                             None))
+    return requirements
+
+
+def selector_matches(requirements, labels):
+    for key, op, values in requirements:
+        if op == 'in' and labels.get(key) not in values:
+            return False
+        if op in ('notin', '!=') and labels.get(key) in values:
+            return False
+        if op == 'exists' and key not in labels:
+            return False
+        if op == '!' and key in labels:
+            return False
+    return True
 
-class KubeManager(object):
 
-    def __init__(self, module):
+def definition_files(paths):
+    """Expand directories to the definition files in them, like kubectl -f."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if name.endswith(DEFINITION_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+
+def contains(live, desired):
+    """Whether the live object already has every field the definition sets.
+
+    The API server fills in defaults and status, so only the fields of the
+    definition are compared.
+    """
+    if isinstance(desired, dict):
+        return isinstance(live, dict) and all(
+            contains(live.get(key), value) if key in live else value in (None, {}, [])
+            for key, value in desired.items())
+    if isinstance(desired, list):
+        return (isinstance(live, list) and len(live) == len(desired) and
+                all(contains(item, value) for item, value in zip(live, desired)))
+    # int-or-string fields, like ports, come back in either form
+    return desired == live or str(desired) == str(live)
+
+
+def ready(obj, kind):
+    """Whether obj has finished rolling out, as far as its status tells."""
+    status = obj.get('status') or {}
+    spec = obj.get('spec') or {}
+    generation = obj['metadata'].get('generation')
+    if generation and status.get('observedGeneration', generation) < generation:
+        return False
+
+    conditions = dict((condition['type'], condition['status'])
+                      for condition in status.get('conditions') or [])
+    if kind == 'Pod':
+        return conditions.get('Ready') == 'True'
+    if kind == 'Job':
+        return conditions.get('Complete') == 'True'
+    if kind == 'DaemonSet':
+        desired = status.get('desiredNumberScheduled', 0)
+        return (status.get('numberReady', 0) >= desired and
+                status.get('updatedNumberScheduled', desired) >= desired)
+    if 'replicas' in spec or kind in ('Deployment', 'ReplicaSet', 'ReplicationController',
+                                      'StatefulSet'):
+        replicas = spec.get('replicas', 1)
+        if kind == 'Deployment' and status.get('updatedReplicas', 0) < replicas:
+            return False
+        return status.get('readyReplicas', 0) >= replicas
+    for condition in ('Ready', 'Available'):
+        if condition in conditions:
+            return conditions[condition] == 'True'
+    return True
+
+
+def response_lines(response):
+    """Yield the lines of a streamed, possibly chunked, response."""
+    if hasattr(response, 'read1'):
+        # python 3 decodes the chunks itself
+        for line in iter(response.readline, b''):
+            yield line
+        return
+
+    pending = b''
+    while True:
+        if response.chunked:
+            size = int(response.fp.readline().split(b';')[0], 16)
+            if not size:
+                break
+            data = response.fp.read(size)
+            response.fp.readline()
+        else:
+            data = response.fp.readline()
+            if not data:
+                break
+        lines = (pending + data).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def object_result(kind, name, action=None, filename=None, failed=False, msg=None):
+    return {
+        'kind': kind,
+        'name': name,
+        'filename': filename,
+        'changed': bool(action) and action != 'unchanged' and not failed,
+        'failed': failed,
+        'msg': msg or ('%s "%s" %s' % (kind, name, action or 'unchanged')),
+    }
 
-        self.module = module
 
-        self.base_cmd = [module.get_bin_path('kubectl', True)]
+class KubeManager(object):
 
-        if module.params.get('server'):
-            self.base_cmd.append('--server=' + module.params.get('server'))
+    def __init__(self, module):
 
-        if module.params.get('log_level'):
-            self.base_cmd.append('--v=' + str(module.params.get('log_level')))
+        self.module = module
 
-        if module.params.get('namespace'):
-            self.base_cmd.append('--namespace=' + module.params.get('namespace'))
+        self.base_cmd = self._base_cmd()
 
         self.all = module.params.get('all')
         self.force = module.params.get('force')
         self.name = module.params.get('name')
-        self.filename = module.params.get('filename')
+        filenames = module.params.get('filename') or []
+        self.bulk = len(filenames) > 1 or any(os.path.isdir(path) for path in filenames)
+        self.filenames = definition_files(filenames)
+        self.filename = self.filenames[0] if self.filenames else None
         self.resource = module.params.get('resource')
         self.label = module.params.get('label')
 
+        # objects of each resource type listed during this run, for exists
+        self._listings = {}
+
+    def _base_cmd(self):
+        params = self.module.params
+        base_cmd = [self.module.get_bin_path('kubectl', True)]
+
+        if params.get('server'):
+            base_cmd.append('--server=' + params.get('server'))
+
+        if params.get('log_level'):
+            base_cmd.append('--v=' + str(params.get('log_level')))
+
+        if params.get('namespace'):
+            base_cmd.append('--namespace=' + params.get('namespace'))
+
+        return base_cmd
+
     def _execute(self, cmd):
         args = self.base_cmd + cmd
         try:
@@ -119,6 +427,7 @@ class KubeManager(object):
         except Exception as exc:
             self.module.fail_json(
                 msg='error running kubectl (%s) command: %s' % (' '.join(args), str(exc)))
+        self._listings.clear()
         return out.splitlines()
 
     def _execute_nofail(self, cmd):
@@ -160,7 +469,7 @@ class KubeManager(object):
 
     def delete(self):
 
-        if not self.force and not self.exists():
+        if not self.force and not self.exists(all_namespaces=False):
             return []
 
         cmd = ['delete']
@@ -187,33 +496,50 @@ class KubeManager(object):
 
         return self._execute(cmd)
 
-    def exists(self):
-        cmd = ['get']
+    def _listing(self, all_namespaces=False):
+        """Return every object of the resource type in the namespace, or in
+        all of them, with one kubectl get per run."""
+        key = (self.resource, all_namespaces)
+        if key not in self._listings:
+            cmd = ['get', self.resource, '--output=json']
+
+            if all_namespaces:
+                cmd.append('--all-namespaces')
+
+            result = self._execute_nofail(cmd)
+            try:
+                items = json.loads('\n'.join(result)).get('items', []) if result else []
+            except ValueError:
+                items = []
+            self._listings[key] = items
+        return self._listings[key]
+
+    def _matching(self, all_namespaces=False):
+        """Return the listed objects that the name and label options select."""
+        try:
+            requirements = parse_selector(self.label) if self.label else []
+        except ValueError as exc:
+            self.module.fail_json(msg=str(exc))
+        return [item for item in self._listing(all_namespaces)
+                if (not self.name or item['metadata']['name'] == self.name) and
+                selector_matches(requirements, item['metadata'].get('labels') or {})]
+
+    def exists(self, all_namespaces=None):
+        """Return whether the name and label options select any object; with
+        all set, in any namespace unless all_namespaces is False, since
+        deleting and stopping only ever affect the namespace."""
 
         if not self.resource:
             return False
 
-        cmd.append(self.resource)
-
-        if self.name:
-            cmd.append(self.name)
+        if all_namespaces is None:
+            all_namespaces = self.all
 
-        cmd.append('--no-headers')
-
-        if self.label:
-            cmd.append('--selector=' + self.label)
-
-        if self.all:
-            cmd.append('--all-namespaces')
-
-        result = self._execute_nofail(cmd)
-        if not result:
-            return False
-        return True
+        return bool(self._matching(all_namespaces))
 
     def stop(self):
 
-        if not self.force and not self.exists():
+        if not self.force and not self.exists(all_namespaces=False):
             return []
 
         cmd = ['stop']
@@ -240,13 +566,797 @@ class KubeManager(object):
 
         return self._execute(cmd)
 
+    def _diff(self, filenames):
+        """Return the (kind, name) of every object whose live state differs
+        from its definition."""
+        args = self.base_cmd + ['diff'] + APPLY_ARGS
+        args.extend('--filename=' + filename for filename in filenames)
+        try:
+            rc, out, err = self.module.run_command(args)
+        except Exception as exc:
+            self.module.fail_json(
+                msg='error running kubectl (%s) command: %s' % (' '.join(args), str(exc)))
+
+        # 0 is no differences and 1 is differences found
+        if rc > 1:
+            self.module.fail_json(
+                msg='error running kubectl (%s) command (rc=%d): %s' %
+                (' '.join(args), rc, err or out))
+
+        differences = set()
+        for line in out.splitlines():
+            if not line.startswith('diff '):
+                continue
+            match = KUBECTL_DIFF_TARGET.match(os.path.basename(line.split()[-1]))
+            if match:
+                differences.add((match.group('kind').lower(), match.group('name')))
+        if rc == 1 and not differences:
+            # a diff we cannot attribute to objects, so all may have changed
+            differences.add((None, None))
+        return differences
+
+    def update(self):
+
+        if not self.filename:
+            self.module.fail_json(msg='filename required to update')
+
+        differences = self._diff([self.filename])
+        if not differences:
+            return []
+
+        result = []
+        for line in self._execute(['apply'] + APPLY_ARGS + ['--filename=' + self.filename]):
+            match = KUBECTL_RESULT.match(line)
+            if not match or self._differs(match, differences):
+                result.append(line)
+        return result
+
+    @staticmethod
+    def _differs(match, differences):
+        """Whether the object of a kubectl result line is one _diff found."""
+        return ((None, None) in differences or
+                (match.group('kind').split('.')[0], match.group('name')) in differences)
+
+    def wait(self, changed):
+        """Wait for the objects of the kubectl result lines changed to be
+        ready, or deleted."""
+        deadline = time.time() + self.module.params.get('wait_timeout')
+        namespaces = self._namespaces()
+
+        groups = {}
+        rollouts = []
+        for line in changed:
+            match = KUBECTL_RESULT.match(line)
+            if match is None:
+                continue
+            kind = match.group('kind')
+            target = kind + '/' + match.group('name')
+            namespace = namespaces.get((kind.split('.')[0], match.group('name')), '')
+            if match.group('action') == 'deleted':
+                groups.setdefault((namespace, '--for=delete'), []).append(target)
+            elif kind.split('.')[0] == 'pod':
+                groups.setdefault((namespace, '--for=condition=Ready'), []).append(target)
+            elif kind.split('.')[0] == 'job':
+                groups.setdefault((namespace, '--for=condition=Complete'), []).append(target)
+            elif kind.split('.')[0] in ('deployment', 'daemonset', 'statefulset'):
+                rollouts.append((namespace, target))
+
+        cmds = [(namespace, ['wait', condition] + targets)
+                for (namespace, condition), targets in sorted(groups.items())]
+        cmds.extend((namespace, ['rollout', 'status', target]) for namespace, target in rollouts)
+        for namespace, cmd in cmds:
+            remaining = int(deadline - time.time())
+            if remaining <= 0:
+                self.module.fail_json(msg='timed out waiting for %s' % ' '.join(cmd[2:]))
+            # the last --namespace wins over the one of the task
+            if namespace:
+                cmd.append('--namespace=' + namespace)
+            self._execute(cmd + ['--timeout=%ds' % remaining])
+
+    def _namespaces(self):
+        """Return the namespace of every object whose definition sets one,
+        by its lower case kind and name, as kubectl only names the kind and
+        name of the objects it changed."""
+        namespaces = {}
+        for filename in self.filenames:
+            try:
+                objects = load_definitions(filename)
+            except (IOError, OSError, ValueError):
+                # kubectl read the file, only its namespaces are lost
+                continue
+            for obj in objects:
+                metadata = obj.get('metadata') or {}
+                if metadata.get('namespace'):
+                    namespaces[(obj.get('kind', '').lower(), metadata.get('name'))] = \
+                        metadata['namespace']
+        return namespaces
+
+    def apply_all(self, state):
+        """Apply every definition file with one kubectl run and return a
+        result per object."""
+        if not self.filenames:
+            self.module.fail_json(msg='no definition files found in %s' %
+                                  ', '.join(self.module.params.get('filename')))
+
+        if state not in BULK_COMMANDS:
+            self.module.fail_json(msg='state=%s with several definition files needs '
+                                      'transport=api' % state)
+
+        cmd = [BULK_COMMANDS[state]]
+
+        if state == 'latest':
+            differences = self._diff(self.filenames)
+            if not differences:
+                return []
+            cmd.extend(APPLY_ARGS)
+
+        if state == 'reloaded' and self.force:
+            cmd.append('--force')
+
+        if state == 'absent':
+            cmd.append('--ignore-not-found')
+
+        cmd.extend('--filename=' + filename for filename in self.filenames)
+
+        args = self.base_cmd + cmd
+        try:
+            rc, out, err = self.module.run_command(args)
+        except Exception as exc:
+            self.module.fail_json(
+                msg='error running kubectl (%s) command: %s' % (' '.join(args), str(exc)))
+
+        results = []
+        unparsed = []
+        for line in out.splitlines():
+            match = KUBECTL_RESULT.match(line)
+            if not match:
+                continue
+            action = match.group('action')
+            # every object of the files is applied; only the ones the diff
+            # found have changed
+            if state == 'latest' and not self._differs(match, differences):
+                action = 'unchanged'
+            results.append(object_result(match.group('kind'), match.group('name'), action))
+
+        # kubectl goes on past objects it cannot change and reports them as
+        # errors; the ones that are already in the requested state are not
+        for line in err.splitlines():
+            match = KUBECTL_ERROR.search(line)
+            if match is None:
+                if line.strip():
+                    unparsed.append(line)
+                continue
+            expected = (match.group('reason') == 'AlreadyExists' and state == 'present' or
+                        match.group('reason') == 'NotFound' and state == 'reloaded' and
+                        not self.force)
+            results.append(object_result(match.group('kind'), match.group('name'),
+                                         filename=match.group('filename'),
+                                         failed=not expected,
+                                         msg=None if expected else '%s "%s" %s' % (
+                                             match.group('kind'), match.group('name'),
+                                             match.group('msg'))))
+
+        # a failure is only left to the results when every line of stderr
+        # was one of their errors
+        if rc != 0 and (unparsed or not err.strip()):
+            self.module.fail_json(
+                msg='error running kubectl (%s) command (rc=%d): %s' %
+                (' '.join(args), rc, '\n'.join(unparsed) or out),
+                changed=any(result['changed'] for result in results), results=results)
+
+        self._listings.clear()
+        return results
+
+
+class KubeApiError(Exception):
+
+    def __init__(self, method, path, status, reason):
+        super(KubeApiError, self).__init__(
+            '%s %s failed (%s): %s' % (method, path, status, reason))
+        self.status = status
+
+
+def closed_by_server(exc):
+    """Whether exc means the server had closed a kept-alive connection
+    before the request reached it, so that sending it again is safe."""
+    if isinstance(exc, socket.timeout):
+        return False
+    # RemoteDisconnected, a response that never started, is one of these
+    if isinstance(exc, httplib.BadStatusLine):
+        return True
+    return getattr(exc, 'errno', None) in (errno.ECONNRESET, errno.EPIPE)
+
+
+class KubeApiClient(object):
+    """Minimal Kubernetes API client.
+
+    Every request goes over the same HTTP/1.1 connection, which is only
+    opened again if the server closes it, so a task pays for one TCP and TLS
+    handshake no matter how many requests it makes.
+    """
+
+    def __init__(self, server, token=None, ca_cert=None, client_cert=None,
+                 client_key=None, validate_certs=True, timeout=30):
+        url = urlparse(server)
+        self.https = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.https else 80)
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.headers = {'Accept': 'application/json',
+                        'User-Agent': 'ansible-kube'}
+        if token:
+            self.headers['Authorization'] = 'Bearer ' + token
+
+        self.context = None
+        if self.https:
+            import ssl
+            if validate_certs:
+                self.context = ssl.create_default_context(cafile=ca_cert)
+            else:
+                self.context = ssl._create_unverified_context()
+            if client_cert:
+                self.context.load_cert_chain(client_cert, client_key)
+
+        self.connection = None
+
+    def _connect(self):
+        if self.https:
+            return httplib.HTTPSConnection(self.host, self.port,
+                                           timeout=self.timeout,
+                                           context=self.context)
+        return httplib.HTTPConnection(self.host, self.port,
+                                      timeout=self.timeout)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, method, path, body=None, params=None,
+                content_type='application/json'):
+        """Return the decoded response to a request, or raise KubeApiError."""
+        url = self.prefix + path
+        if params:
+            url += '?' + urlencode(sorted(params.items()))
+        headers = dict(self.headers)
+        if body is not None:
+            if not isinstance(body, str):
+                body = json.dumps(body)
+            headers['Content-Type'] = content_type
+
+        # a kept-alive connection may have been closed by the server since
+        # the last request; only then is the request sent again, on a fresh
+        # one, as anything else may have reached the server already
+        reused = self.connection is not None
+        while True:
+            if self.connection is None:
+                self.connection = self._connect()
+            try:
+                self.connection.request(method, url, body, headers)
+                response = self.connection.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error) as exc:
+                self.close()
+                if not (reused and closed_by_server(exc)):
+                    raise
+                reused = False
+                continue
+
+            if (response.getheader('Connection') or '').lower() == 'close':
+                self.close()
+            break
+
+        try:
+            data = json.loads(content.decode('utf-8')) if content else None
+        except ValueError:
+            data = None
+
+        if response.status >= 400:
+            reason = (data or {}).get('message') if isinstance(data, dict) \
+                else None
+            raise KubeApiError(method, path, response.status,
+                               reason or content.decode('utf-8', 'replace')
+                               or response.reason)
+
+        return data
+
+    def watch(self, path, params, timeout):
+        """Yield the events of a watch on path until the server ends it.
+
+        The stream takes over the connection, which is closed afterwards.
+        """
+        url = self.prefix + path + '?' + urlencode(sorted(dict(params, watch='true').items()))
+        if self.connection is None:
+            self.connection = self._connect()
+        try:
+            self.connection.request('GET', url, headers=self.headers)
+            response = self.connection.getresponse()
+            if response.status >= 400:
+                content = response.read().decode('utf-8', 'replace')
+                raise KubeApiError('GET', path, response.status, content or response.reason)
+            self.connection.sock.settimeout(timeout)
+            for line in response_lines(response):
+                if line.strip():
+                    yield json.loads(line.decode('utf-8'))
+        finally:
+            self.close()
+
+
+def load_definitions(filename):
+    """Return the objects defined in a JSON or YAML file, expanding Lists."""
+    with open(filename) as definition_file:
+        content = definition_file.read()
+
+    if filename.endswith('.json') or content.lstrip().startswith('{'):
+        documents = [json.loads(content)]
+    else:
+        if yaml is None:
+            raise ValueError('PyYAML is required to read %s' % filename)
+        try:
+            documents = list(yaml.safe_load_all(content))
+        except yaml.YAMLError as exc:
+            raise ValueError(str(exc))
+
+    objects = []
+    for document in documents:
+        if not document:
+            continue
+        if not isinstance(document, dict):
+            raise ValueError('%s does not define an object' % filename)
+        if document.get('kind', '').endswith('List') and 'items' in document:
+            objects.extend(document['items'])
+        else:
+            objects.append(document)
+    return objects
+
+
+class KubeApiManager(KubeManager):
+    """KubeManager that talks to the API server instead of running kubectl."""
+
+    def __init__(self, module):
+        super(KubeApiManager, self).__init__(module)
+
+        params = module.params
+        self.namespace = params.get('namespace') or 'default'
+        self.client = KubeApiClient(
+            params.get('server') or 'http://localhost:8080',
+            token=params.get('api_token'),
+            ca_cert=params.get('ca_cert'),
+            client_cert=params.get('client_cert'),
+            client_key=params.get('client_key'),
+            validate_certs=params.get('validate_certs'))
+        self._group_versions = {}
+        self._preferred = None
+        # (path, kind, deleted) of every object changed, for wait
+        self.touched = []
+
+    def _base_cmd(self):
+        return None
+
+    @contextmanager
+    def _api_errors(self, **result):
+        """Fail the task on errors from the API server, or reaching it,
+        in the body; result is added to the failure."""
+        try:
+            yield
+        except KubeApiError as exc:
+            self.module.fail_json(msg='error calling the Kubernetes API: %s' % exc,
+                                  status=exc.status, **result)
+        except (httplib.HTTPException, socket.error) as exc:
+            self.module.fail_json(msg='error connecting to the Kubernetes API '
+                                      'server: %s' % exc, **result)
+
+    def _request(self, method, path, body=None, params=None, **kwargs):
+        if method != 'GET':
+            self._listings.clear()
+        with self._api_errors():
+            return self.client.request(method, path, body, params, **kwargs)
+
+    def _get(self, path, params=None):
+        """Return the object at path, or None if it does not exist."""
+        with self._api_errors():
+            return self._live(path, params)
+
+    # discovery
+    def _resources(self, group_version):
+        """Map the kinds and names of a group version to their resources."""
+        if group_version not in self._group_versions:
+            if group_version == 'v1':
+                path = '/api/v1'
+            else:
+                path = '/apis/' + group_version
+            found = {}
+            for resource in (self._get(path) or {}).get('resources', []):
+                if '/' in resource['name']:
+                    continue
+                resource = dict(resource, groupVersion=group_version)
+                found.setdefault(resource['kind'], resource)
+                names = [resource['name'], resource['kind'].lower(),
+                         resource.get('singularName')]
+                for name in names + resource.get('shortNames', []):
+                    if name:
+                        found.setdefault(name.lower(), resource)
+            self._group_versions[group_version] = found
+        return self._group_versions[group_version]
+
+    def _preferred_versions(self):
+        if self._preferred is None:
+            groups = (self._get('/apis') or {}).get('groups', [])
+            self._preferred = [group['preferredVersion']['groupVersion']
+                               for group in groups]
+        return self._preferred
+
+    def _resource_for(self, api_version, kind):
+        resource = self._resources(api_version).get(kind)
+        if resource is None:
+            raise KubeApiError('GET', '/apis/' + api_version, 404,
+                               'the API server does not serve %s in %s' % (kind, api_version))
+        return resource
+
+    def _resource_named(self, name):
+        """Resolve a kubectl style resource name like rc or deployments."""
+        name = name.lower()
+        name = KUBECTL_ALIASES.get(name, name)
+        resource = self._resources('v1').get(name)
+        if resource is not None:
+            return resource
+        for group_version in self._preferred_versions():
+            resource = self._resources(group_version).get(name)
+            if resource is not None:
+                return resource
+        self.module.fail_json(msg='unknown resource type %s' % name)
+
+    def _path(self, resource, namespace=None, name=None):
+        group_version = resource['groupVersion']
+        if group_version == 'v1':
+            path = '/api/v1'
+        else:
+            path = '/apis/' + group_version
+        if resource.get('namespaced') and namespace:
+            path += '/namespaces/' + quote(namespace, safe='')
+        path += '/' + resource['name']
+        if name:
+            path += '/' + quote(name, safe='')
+        return path
+
+    def _object_path(self, obj, name=True):
+        resource = self._resource_for(obj['apiVersion'], obj['kind'])
+        metadata = obj.get('metadata', {})
+        namespace = metadata.get('namespace') or self.namespace
+        return resource, self._path(resource, namespace,
+                                    metadata['name'] if name else None)
+
+    def _target(self, obj, name=True):
+        try:
+            return self._object_path(obj, name)
+        except KubeApiError as exc:
+            self.module.fail_json(msg=str(exc))
+
+    def _definitions(self):
+        try:
+            return load_definitions(self.filename)
+        except (IOError, OSError, ValueError) as exc:
+            self.module.fail_json(msg='cannot read %s: %s' % (self.filename, exc))
+
+    @staticmethod
+    def _describe(obj, action):
+        return '%s "%s" %s' % (obj['kind'].lower(), obj['metadata']['name'],
+                               action)
+
+    def _listing(self, all_namespaces=False):
+        """Return every object of the resource type in the namespace, or in
+        all of them, with one list request per run."""
+        resource = self._resource_named(self.resource)
+        namespace = None if all_namespaces else self.namespace
+        key = (resource['groupVersion'], resource['name'], namespace)
+        if key not in self._listings:
+            listing = self._get(self._path(resource, namespace)) or {}
+            self._listings[key] = listing.get('items', [])
+        return self._listings[key]
+
+    def _selected(self):
+        """Return (resource, path) of every object in the namespace the name,
+        label and all options select, which like kubectl delete --all never
+        reaches into other namespaces."""
+        resource = self._resource_named(self.resource)
+        return [(resource, self._path(resource, self.namespace,
+                                      item['metadata']['name']))
+                for item in self._matching()]
+
+    def create(self, check=True):
+        if check and self.exists():
+            return []
+
+        if not self.filename:
+            self.module.fail_json(msg='filename required to create')
+
+        result = []
+        for obj in self._definitions():
+            _, path = self._target(obj)
+            self._request('POST', path.rsplit('/', 1)[0], obj)
+            self.touched.append((path, obj['kind'], False))
+            result.append(self._describe(obj, 'created'))
+        return result
+
+    def replace(self):
+
+        if not self.force and not self.exists():
+            return []
+
+        if not self.filename:
+            self.module.fail_json(msg='filename required to reload')
+
+        result = []
+        for obj in self._definitions():
+            _, path = self._target(obj)
+            if self.force:
+                with self._api_errors():
+                    self._recreate(path, obj)
+            else:
+                live = self._get(path)
+                if live is None:
+                    self.module.fail_json(msg='%s does not exist' % path)
+                obj = dict(obj, metadata=dict(
+                    obj['metadata'],
+                    resourceVersion=live['metadata']['resourceVersion']))
+                self._request('PUT', path, obj)
+            self.touched.append((path, obj['kind'], False))
+            result.append(self._describe(obj, 'replaced'))
+        return result
+
+    def _delete(self, body=None):
+        result = []
+        if self.filename:
+            targets = [(obj, self._target(obj)[1])
+                       for obj in self._definitions()]
+        else:
+            if not self.resource:
+                self.module.fail_json(msg='resource required to delete without filename')
+            if not (self.name or self.label or self.all):
+                self.module.fail_json(msg='name, label or all required to delete '
+                                          'without filename')
+            targets = [({'kind': resource['kind'],
+                         'metadata': {'name': path.rsplit('/', 1)[1]}}, path)
+                       for resource, path in self._selected()]
+
+        for obj, path in targets:
+            with self._api_errors():
+                try:
+                    self.client.request('DELETE', path, body)
+                except KubeApiError as exc:
+                    if exc.status != 404 or not self.force:
+                        raise
+                    continue
+            self.touched.append((path, obj['kind'], True))
+            result.append(self._describe(obj, 'deleted'))
+        self._listings.clear()
+        return result
+
+    def delete(self):
+
+        if not self.force and not self.exists(all_namespaces=False):
+            return []
+
+        return self._delete()
+
+    def _recreate(self, path, obj):
+        """Delete the object at path and create obj once it is gone, like
+        kubectl replace --force. Pods terminate gracefully and finalizers
+        hold objects back, and until then a create fails with AlreadyExists."""
+        self._listings.clear()
+        try:
+            self.client.request('DELETE', path)
+        except KubeApiError as exc:
+            if exc.status != 404:
+                raise
+
+        timeout = self.module.params.get('wait_timeout')
+        deadline = time.time() + timeout
+        delay = 0.1
+        while self._live(path) is not None:
+            if time.time() >= deadline:
+                raise KubeApiError('DELETE', path, 409,
+                                   'still being deleted after %ds' % timeout)
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
+
+        self.client.request('POST', path.rsplit('/', 1)[0], obj)
+
+    def _live(self, path, params=None):
+        """Return the object at path, or None if it does not exist."""
+        try:
+            return self.client.request('GET', path, params=params)
+        except KubeApiError as exc:
+            if exc.status != 404:
+                raise
+
+    def _update(self, obj):
+        """Server-side apply obj unless the live object already matches it."""
+        _, path = self._object_path(obj)
+        live = self._live(path)
+        if live is not None and contains(live, obj):
+            return 'unchanged'
+
+        applied = self.client.request('PATCH', path, obj,
+                                      {'fieldManager': FIELD_MANAGER, 'force': 'true'},
+                                      content_type='application/apply-patch+yaml')
+        if live is None:
+            return 'created'
+        # an apply that sets nothing new leaves the object as it was
+        if applied['metadata'].get('resourceVersion') == live['metadata'].get('resourceVersion'):
+            return 'unchanged'
+        return 'configured'
+
+    def update(self):
+
+        if not self.filename:
+            self.module.fail_json(msg='filename required to update')
+
+        result = []
+        for obj in self._definitions():
+            with self._api_errors():
+                action = self._update(obj)
+            if action != 'unchanged':
+                self.touched.append((self._target(obj)[1], obj['kind'], False))
+                result.append(self._describe(obj, action))
+        self._listings.clear()
+        return result
+
+    def _apply_object(self, obj, state):
+        """Bring one object to state and return what was done to it."""
+        if state == 'latest':
+            return self._update(obj)
+
+        _, path = self._object_path(obj)
+        live = None
+        if state in ('present', 'reloaded'):
+            live = self._live(path)
+
+        if state in ('absent', 'stopped'):
+            body = None
+            if state == 'stopped':
+                body = {'kind': 'DeleteOptions', 'apiVersion': 'v1',
+                        'propagationPolicy': 'Foreground'}
+            try:
+                self.client.request('DELETE', path, body)
+            except KubeApiError as exc:
+                if exc.status != 404:
+                    raise
+                return 'unchanged'
+            return 'deleted'
+
+        if live is None:
+            if state == 'reloaded' and not self.force:
+                return 'unchanged'
+            self.client.request('POST', path.rsplit('/', 1)[0], obj)
+            return 'created'
+
+        if state == 'present':
+            return 'unchanged'
+
+        if state == 'reloaded' and self.force:
+            self._recreate(path, obj)
+            return 'replaced'
+
+        obj = dict(obj, metadata=dict(obj['metadata'],
+                                      resourceVersion=live['metadata']['resourceVersion']))
+        self.client.request('PUT', path, obj)
+        return 'replaced'
+
+    def apply_all(self, state):
+        """Apply every object of every definition file over the one API
+        connection and return a result per object."""
+        if not self.filenames:
+            self.module.fail_json(msg='no definition files found in %s' %
+                                  ', '.join(self.module.params.get('filename')))
+
+        results = []
+        for filename in self.filenames:
+            try:
+                objects = load_definitions(filename)
+            except (IOError, OSError, ValueError) as exc:
+                results.append(object_result(None, None, filename=filename, failed=True,
+                                             msg='cannot read %s: %s' % (filename, exc)))
+                continue
+
+            for obj in objects:
+                kind = obj.get('kind', '').lower()
+                name = obj.get('metadata', {}).get('name')
+                # an object the API server refuses fails on its own, losing
+                # the server fails the task
+                with self._api_errors(results=results):
+                    try:
+                        action = self._apply_object(obj, state)
+                    except KubeApiError as exc:
+                        results.append(object_result(kind, name, filename=filename,
+                                                     failed=True, msg=str(exc)))
+                        continue
+                if action != 'unchanged':
+                    self.touched.append((self._object_path(obj)[1], obj['kind'],
+                                         action == 'deleted'))
+                results.append(object_result(kind, name, action, filename))
+        self._listings.clear()
+        return results
+
+    def wait(self, changed):
+        """Wait for every object changed to be ready, or gone, watching each
+        collection they are in with one stream."""
+        deadline = time.time() + self.module.params.get('wait_timeout')
+
+        collections = {}
+        for path, kind, deleted in self.touched:
+            collection, name = path.rsplit('/', 1)
+            collections.setdefault(collection, {})[name] = (kind, deleted)
+
+        for collection, pending in sorted(collections.items()):
+            with self._api_errors():
+                try:
+                    self._wait_collection(collection, pending, deadline)
+                except socket.timeout:
+                    # reported as a timeout below
+                    pass
+            if pending:
+                self.module.fail_json(msg='timed out after %ds waiting for %s' % (
+                    self.module.params.get('wait_timeout'),
+                    ', '.join('%s "%s"' % (kind.lower(), name)
+                              for name, (kind, _) in sorted(pending.items()))))
+
+    def _wait_collection(self, collection, pending, deadline):
+        """Remove the names from pending as their objects become ready."""
+        def settle(obj, event):
+            name = obj['metadata']['name']
+            if name not in pending:
+                return
+            kind, deleted = pending[name]
+            if (event == 'DELETED') if deleted else (event != 'DELETED' and ready(obj, kind)):
+                del pending[name]
+
+        params = {}
+        if len(pending) == 1:
+            params['fieldSelector'] = 'metadata.name=' + list(pending)[0]
+
+        while pending and time.time() < deadline:
+            listing = self.client.request('GET', collection, params=params)
+            listed = set()
+            for item in listing.get('items', []):
+                listed.add(item['metadata']['name'])
+                settle(item, 'ADDED')
+            for name in [name for name in pending if pending[name][1] and name not in listed]:
+                del pending[name]
+
+            # watch from the listing on; a watch that expired (410 Gone) just
+            # lists again
+            version = listing['metadata'].get('resourceVersion')
+            remaining = deadline - time.time()
+            if not pending or remaining <= 0:
+                break
+            watch = dict(params, resourceVersion=version, timeoutSeconds=int(remaining) + 1)
+            for event in self.client.watch(collection, watch, remaining + 5):
+                if event['type'] == 'ERROR':
+                    break
+                if event['type'] != 'BOOKMARK':
+                    settle(event['object'], event['type'])
+                if not pending:
+                    break
+
+    def stop(self):
+
+        if not self.force and not self.exists(all_namespaces=False):
+            return []
+
+        # kubectl stop scaled controllers down before deleting them; foreground
+        # deletion likewise removes the dependents first
+        return self._delete({'kind': 'DeleteOptions', 'apiVersion': 'v1',
+                             'propagationPolicy': 'Foreground'})
+
 
 def main():
 
     module = AnsibleModule(
         argument_spec=dict(
             name=dict(),
-            filename=dict(),
+            filename=dict(type='list'),
             namespace=dict(),
             resource=dict(),
             label=dict(),
@@ -255,15 +1365,41 @@ def main():
             force=dict(default=False, type='bool'),
             all=dict(default=False, type='bool'),
             log_level=dict(default=0, type='int'),
+            transport=dict(default='kubectl', choices=['kubectl', 'api']),
+            api_token=dict(no_log=True),
+            ca_cert=dict(),
+            client_cert=dict(),
+            client_key=dict(),
+            validate_certs=dict(default=True, type='bool'),
+            wait=dict(default=False, type='bool'),
+            wait_timeout=dict(default=300, type='int'),
             state=dict(default='present', choices=['present', 'absent', 'latest', 'reloaded', 'stopped']),
         )
     )
 
     changed = False
 
-    manager = KubeManager(module)
+    if module.params.get('transport') == 'api':
+        manager = KubeApiManager(module)
+    else:
+        manager = KubeManager(module)
     state = module.params.get('state')
 
+    if manager.bulk:
+        results = manager.apply_all(state)
+        changed = any(result['changed'] for result in results)
+        failed = [result for result in results if result['failed']]
+        if changed and not failed and module.params.get('wait'):
+            manager.wait([result['msg'] for result in results if result['changed']])
+        if failed:
+            module.fail_json(changed=changed, results=results,
+                             msg='%d of %d objects failed: %s' %
+                             (len(failed), len(results),
+                              '; '.join(result['msg'] for result in failed)))
+        module.exit_json(changed=changed, results=results,
+                         msg='success: %s' % ' '.join(result['msg'] for result in results
+                                                      if result['changed']))
+
     if state == 'present':
         result = manager.create()
 
@@ -277,17 +1413,15 @@ def main():
         result = manager.stop()
 
     elif state == 'latest':
-        if manager.exists():
-            manager.force = True
-            result = manager.replace()
-        else:
-            result = manager.create(check=False)
+        result = manager.update()
 
     else:
         module.fail_json(msg='Unrecognized state %s.' % state)
 
     if result:
         changed = True
+        if module.params.get('wait'):
+            manager.wait(result)
     module.exit_json(changed=changed,
                      msg='success: %s' % (' '.join(result))
                      )
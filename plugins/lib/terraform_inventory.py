@@ -0,0 +1,2811 @@
+#
+# Copyright 2015 Cisco Systems, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License a
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Dynamic inventory for Terraform - finds all `.tfstate` files below the working
+directory, plus any remote states given with --remote, and generates an
+inventory based on them.
+"""
+from __future__ import print_function, unicode_literals
+
+# Only modules every run needs are imported here. Slower ones that only
+# some modes use (argparse, hashlib, multiprocessing, socket, tempfile,
+# urllib, ...) are imported where they are used, to keep startup short.
+import fnmatch
+import io
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import chain
+
+VERSION = '0.3.0pre'
+
+
+class _LazyUrllib(object):
+    '''the urllib names used for remote state, imported on first use from
+    wherever this Python keeps them'''
+
+    def __getattr__(self, name):
+        try:
+            from urllib import error, parse, request
+            modules = (error, parse, request)
+        except ImportError:  # python 2
+            import urllib
+            import urllib2
+            import urlparse
+            modules = (urllib2, urlparse, urllib)
+
+        for module in modules:
+            if hasattr(module, name):
+                value = getattr(module, name)
+                setattr(self, name, value)
+                return value
+
+        raise AttributeError(name)
+
+
+urllib = _LazyUrllib()
+
+
+# PROFILING
+_clock = getattr(time, 'perf_counter', time.time)
+
+try:
+    from _thread import get_ident
+except ImportError:  # python 2
+    from thread import get_ident
+
+
+class Profiler(object):
+    '''timing spans and totals for --profile
+
+    Spans cover coarse steps such as discovery, loading one state file or
+    writing the output, and nest. Work too fine-grained for a span of its
+    own, like a single parser call, is summed into totals instead, and
+    plain numbers like skipped resources go to counters. Nothing is
+    recorded unless `enabled` is set. Spans nest per thread, so roots
+    walked in parallel each get their own.
+    '''
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = _clock()
+        self.spans = []
+        self.totals = defaultdict(lambda: [0, 0.0])
+        self.counters = defaultdict(int)
+        # span depth of each thread by its ident
+        self._depths = {}
+
+    @contextmanager
+    def span(self, name, **details):
+        '''time the body; details (which the body may add to) are reported
+        with the span'''
+        if not self.enabled:
+            yield details
+            return
+
+        thread = get_ident()
+        depth = self._depths.get(thread, 0)
+        start = _clock()
+        self._depths[thread] = depth + 1
+        try:
+            yield details
+        finally:
+            self._depths[thread] = depth
+            self.spans.append((thread, depth, name, start - self.started,
+                               _clock() - start, details))
+
+    def add(self, name, seconds, count=1):
+        total = self.totals[name]
+        total[0] += count
+        total[1] += seconds
+
+    def count(self, name, count=1):
+        self.counters[name] += count
+
+    def report(self, dest):
+        '''write a summary to stderr for dest `-`, else a Chrome trace (for
+        chrome://tracing or Perfetto) to the file dest'''
+        if dest == '-':
+            self._summary(sys.stderr)
+            return
+
+        events = [{'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+                   'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+                   'args': details}
+                  for thread, _, name, start, duration, details in self.spans]
+        totals = dict((name, {'count': count, 'seconds': seconds})
+                      for name, (count, seconds) in self.totals.items())
+        with open(dest, 'w') as json_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'totals': totals, 'counters': self.counters},
+                      json_file, indent=1)
+
+    def _summary(self, out):
+        print('profile: %.3fs' % (_clock() - self.started), file=out)
+        # spans are recorded as they end, so a parent follows its children
+        for _, depth, name, _, duration, details in sorted(
+                self.spans, key=lambda span: (span[3], span[1])):
+            label = '  ' * (depth + 1) + name
+            extra = ' '.join('%s=%s' % item for item in sorted(details.items()))
+            print('%-48s %9.3fs  %s' % (label, duration, extra), file=out)
+        for name, (count, seconds) in sorted(self.totals.items(),
+                                             key=lambda item: -item[1][1]):
+            print('  %-46s %9.3fs  count=%d' % (name, seconds, count), file=out)
+        for name, count in sorted(self.counters.items()):
+            print('  %-46s %10s  count=%d' % (name, '', count), file=out)
+
+
+profiler = Profiler()
+
+
+# directories that never hold state worth reading but can be very large
+DEFAULT_EXCLUDES = ('.git', '.terraform', '__pycache__', 'docs', 'node_modules')
+
+
+def _excluded(root, dirpath, name, exclude):
+    relpath = os.path.relpath(os.path.join(dirpath, name), root)
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relpath, pattern)
+               for pattern in exclude)
+
+
+def walk(root, exclude=DEFAULT_EXCLUDES):
+    '''yield (dirpath, filenames) below root like os.walk, without descending
+    into directories whose name or path relative to root matches a glob in
+    `exclude`'''
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames
+                       if not _excluded(root, dirpath, name, exclude)]
+        yield dirpath, filenames
+
+
+def _discover(root, include, exclude):
+    '''walk root, returning the mtime of every directory visited and the
+    matching state files'''
+    dirs = {}
+    files = []
+    for dirpath, filenames in walk(root, exclude):
+        dirs[dirpath] = os.stat(dirpath).st_mtime
+        files.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                     if any(fnmatch.fnmatch(name, pattern) for pattern in include)
+                     and not _excluded(root, dirpath, name, exclude))
+
+    return dirs, files
+
+
+def rootstates(roots, include=None, exclude=None, cache_dir=None):
+    '''yield the paths of state files below each of roots, once each
+
+    The roots are walked concurrently, each with its own manifest in
+    `cache_dir`, and their files are yielded in the order of roots.
+    '''
+    def discover(root):
+        manifest = None
+        if cache_dir is not None:
+            manifest = _manifest_path(cache_dir, root)
+        return list(tfstates(root, include, exclude, manifest))
+
+    if len(roots) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(len(roots), 16))
+        try:
+            found = pool.map(discover, roots)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        found = [discover(root) for root in roots]
+
+    # roots may overlap
+    seen = set()
+    for filenames in found:
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            if path not in seen:
+                seen.add(path)
+                yield filename
+
+
+def _workspace(filename):
+    '''return the workspace of a state file that the local backend keeps in
+    terraform.tfstate.d/<workspace>/, or None for any other file'''
+    parts = os.path.normpath(filename).split(os.sep)
+    if len(parts) >= 3 and parts[-3] == 'terraform.tfstate.d':
+        return parts[-2]
+    return None
+
+
+def _roots_key(roots):
+    return '\n'.join(os.path.abspath(root) for root in roots)
+
+
+def _manifest_path(cache_dir, root):
+    import hashlib
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8'))
+    return os.path.join(cache_dir, digest.hexdigest() + '.manifest.json')
+
+
+def _manifest_valid(manifest, key):
+    if manifest.get('key') != key:
+        return False
+
+    for dirpath, mtime in manifest['dirs'].items():
+        try:
+            current = os.stat(dirpath).st_mtime
+        except OSError:
+            return False
+
+        # a directory that changed just before the manifest was written may
+        # change again within the file system's timestamp resolution
+        if current != mtime or current >= manifest['written'] - 2:
+            return False
+
+    return True
+
+
+def tfstates(root=None, include=None, exclude=None, manifest=None):
+    '''yield the paths of state files below root
+
+    Only files matching a glob in `include` (default `*.tfstate`) are found,
+    and directories matching a glob in `exclude` (default DEFAULT_EXCLUDES)
+    are pruned. With `manifest`, the list of files is persisted to that path
+    and reused until the mtime of a directory that was walked changes.
+    '''
+    root = root or os.getcwd()
+    include = include or ['*.tfstate']
+    exclude = DEFAULT_EXCLUDES if exclude is None else exclude
+
+    with profiler.span('tfstates', root=root) as details:
+        files = _tfstates(root, include, exclude, manifest)
+        details['files'] = len(files)
+
+    for filename in files:
+        yield filename
+
+
+def _tfstates(root, include, exclude, manifest):
+    if manifest is None:
+        files = _discover(root, include, exclude)[1]
+    else:
+        key = [VERSION, os.getcwd(), root, sorted(include), sorted(exclude)]
+        try:
+            with open(manifest, 'r') as json_file:
+                entry = json.load(json_file)
+        except (IOError, OSError, ValueError):
+            entry = {}
+
+        if _manifest_valid(entry, key):
+            files = entry['files']
+        else:
+            dirs, files = _discover(root, include, exclude)
+            _write_json(manifest, {'key': key, 'written': time.time(),
+                                   'dirs': dirs, 'files': files})
+
+    return files
+
+
+# REMOTE STATE
+class RemoteState(object):
+    '''a state file fetched from a server into the cache directory
+
+    The last download is kept at `path`, next to a small JSON file with the
+    validator the server sent for it, so fetch() only downloads the state
+    again once the server reports that it changed. Everything downstream
+    treats `path` like any local state file.
+    '''
+    # whether fetch(wait=...) blocks on the server until the state changes
+    blocking = False
+
+    def __init__(self, url, cache_dir, timeout=30):
+        self.url = url
+        self.timeout = timeout
+        import hashlib
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        directory = os.path.join(cache_dir, 'remote')
+        self.path = os.path.join(directory, digest + '.tfstate')
+        self.meta_path = os.path.join(directory, digest + '.json')
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.url)
+
+    def _meta(self):
+        '''return the validators of the last download, if it still exists'''
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.meta_path, 'r') as json_file:
+                return json.load(json_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _open(self, url, headers=None):
+        parts = urllib.urlsplit(url)
+        headers = dict(headers or {})
+        if parts.username is not None:
+            import base64
+            credentials = '%s:%s' % (urllib.unquote(parts.username),
+                                     urllib.unquote(parts.password or ''))
+            headers['Authorization'] = 'Basic ' + base64.b64encode(
+                credentials.encode('utf-8')).decode('ascii')
+            netloc = parts.netloc.rpartition('@')[2]
+            url = parts._replace(netloc=netloc).geturl()
+        return urllib.urlopen(urllib.Request(url, headers=headers),
+                              timeout=self.timeout)
+
+    def _save(self, response, meta):
+        '''stream response to path and record meta for the next fetch'''
+        import tempfile
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as state_file:
+                while True:
+                    chunk = response.read(1 << 16)
+                    if not chunk:
+                        break
+                    state_file.write(chunk)
+            os.rename(tmpname, self.path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+        _write_json(self.meta_path, meta)
+
+    def fetch(self, wait=None):
+        '''bring path up to date, returning whether it was downloaded'''
+        raise NotImplementedError
+
+
+class HttpState(RemoteState):
+    '''a state served over HTTP(S), e.g. by Terraform's http backend, which is
+    only downloaded again when the ETag (or Last-Modified) changes'''
+
+    def fetch(self, wait=None):
+        meta = self._meta()
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = self._open(self.url, headers)
+        except urllib.HTTPError as exc:
+            if exc.code == 304:
+                return False
+            raise
+
+        try:
+            self._save(response, {'etag': response.headers.get('ETag'),
+                                  'last_modified':
+                                      response.headers.get('Last-Modified')})
+        finally:
+            response.close()
+        return True
+
+
+class ConsulState(RemoteState):
+    '''a state stored in Consul's KV store, e.g. by Terraform's consul
+    backend, addressed as consul://host:port/path/to/key?dc=...&token=...
+
+    The X-Consul-Index of the key is checked with a `?keys` request, which
+    returns no values, and the state is only downloaded when it moved. With
+    `wait` the check is a blocking query that returns as soon as the key
+    changes, or after `wait` (a Consul duration such as `5m`) otherwise.
+    Only the index of a `?keys` request is kept: a single key read answers
+    with the index of the whole KV store, which moves with every other
+    key.
+    '''
+    blocking = True
+
+    def __init__(self, url, cache_dir, timeout=30):
+        super(ConsulState, self).__init__(url, cache_dir, timeout)
+        parts = urllib.urlsplit(url)
+        self.address = parts.netloc or 'localhost:8500'
+        self.key = parts.path.lstrip('/')
+        self.params = dict(urllib.parse_qsl(parts.query))
+        self.headers = {}
+        token = self.params.pop('token', os.environ.get('CONSUL_HTTP_TOKEN'))
+        if token:
+            self.headers['X-Consul-Token'] = token
+
+    def _kv(self, timeout=None, **params):
+        query = dict(self.params, **params)
+        url = 'http://%s/v1/kv/%s?%s' % (
+            self.address, urllib.quote(self.key),
+            urllib.urlencode(sorted(query.items())))
+        request = urllib.Request(url, headers=self.headers)
+        return urllib.urlopen(request, timeout=timeout or self.timeout)
+
+    def fetch(self, wait=None):
+        index = self._meta().get('index')
+        if index is not None and wait:
+            # consul holds the request for up to `wait` plus a little
+            # jitter, so give it longer than that before timing out
+            response = self._kv(self.timeout + _duration(wait), keys='',
+                                index=index, wait=wait)
+        else:
+            response = self._kv(keys='')
+        response.close()
+        current = response.headers.get('X-Consul-Index')
+        if index is not None and current == index:
+            return False
+
+        # the index is taken before the download, so a change in between
+        # is only downloaded again on the next fetch, never missed
+        response = self._kv(raw='')
+        try:
+            self._save(response, {'index': current})
+        finally:
+            response.close()
+        return True
+
+
+def _duration(value):
+    '''return the seconds in a Consul duration like 90s or 5m'''
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    match = re.match(r'^(\d+(?:\.\d+)?)(ms|s|m|h)?$', value)
+    if match is None:
+        raise ValueError('invalid duration %r' % value)
+    return float(match.group(1)) * units[match.group(2) or 's']
+
+
+REMOTE_SCHEMES = {
+    'consul': ConsulState,
+    'http': HttpState,
+    'https': HttpState,
+}
+
+
+def remote_state(url, cache_dir):
+    '''return the RemoteState for url'''
+    scheme = urllib.urlsplit(url).scheme
+    try:
+        return REMOTE_SCHEMES[scheme](url, cache_dir)
+    except KeyError:
+        raise ValueError('unsupported remote state %r, expected one of %s' %
+                         (url, ', '.join(s + '://' for s in sorted(REMOTE_SCHEMES))))
+
+
+def refresh(source):
+    '''fetch source, falling back to the last download if the server cannot
+    be reached'''
+    try:
+        with profiler.span('fetch', url=source.url) as details:
+            details['changed'] = source.fetch()
+    except (IOError, OSError) as exc:  # includes URLError and socket errors
+        if not os.path.exists(source.path):
+            raise SystemExit('could not fetch %s: %s' % (source.url, exc))
+        print('could not fetch %s, using the last copy: %s' % (source.url, exc),
+              file=sys.stderr)
+
+
+def remote_states(sources):
+    '''bring each remote source up to date and yield its local path'''
+    for source in sources:
+        refresh(source)
+        yield source.path
+
+
+class StateReader(object):
+    '''incremental reader for `.tfstate` files
+
+    The file is read in chunks and only the resources that are asked for are
+    decoded; every other value is skipped by scanning for its end, so memory
+    use is bounded by the largest single resource rather than the whole file.
+    The number of resources decoded and skipped is counted per type in
+    `decoded` and `skipped`.
+    '''
+    chunk_size = 1 << 16
+
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    _scalar = re.compile(r'[^,:\]}\s]*')
+    _string = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+    # everything up to the next bracket or unterminated string
+    _run = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.decoded = defaultdict(int)
+        self.skipped = defaultdict(int)
+
+    def _fill(self):
+        '''append a chunk to the buffer, dropping everything before the
+        current position; return how far offsets shifted, or None at EOF'''
+        chunk = None if self.eof else self.fileobj.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return None
+
+        shift = self.pos
+        self.buffer = self.buffer[shift:] + chunk
+        self.pos = 0
+        return shift
+
+    def _peek(self):
+        '''skip whitespace and return the next character'''
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self._fill() is None:
+                raise ValueError('unexpected end of state file')
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError('expected one of %r in state file, got %r' %
+                             (chars, char))
+        self.pos += 1
+        return char
+
+    def _scan(self):
+        '''return the offset just past the value at the current position,
+        reading more of the file as needed'''
+        end = self.pos
+        depth = 0
+        while True:
+            if depth == 0 and self.buffer[end] == '"':
+                match = self._string.match(self.buffer, end)
+                if match is not None:
+                    return match.end()
+            elif depth == 0 and self.buffer[end] not in '[{':
+                match = self._scalar.match(self.buffer, end)
+                if match.end() < len(self.buffer) or self.eof:
+                    return match.end()
+            else:
+                end = self._run.match(self.buffer, end).end()
+                if end < len(self.buffer) and self.buffer[end] != '"':
+                    depth += 1 if self.buffer[end] in '[{' else -1
+                    end += 1
+                    if depth == 0:
+                        return end
+                    continue
+
+            shift = self._fill()
+            if shift is None:
+                if depth == 0 and self.buffer[end] not in '"[{':
+                    # a number or literal ends with the file
+                    return len(self.buffer)
+                raise ValueError('unexpected end of state file')
+            end -= shift
+
+    def read_value(self):
+        '''decode the value at the current position'''
+        if self._peek() not in '"[{':
+            # numbers may be cut short by the end of the buffer
+            end = len(self.buffer)
+        else:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+                end = len(self.buffer)
+
+        # the value may have been cut off by the end of the buffer; find its
+        # real end before decoding it again
+        if end == len(self.buffer):
+            end = self._scan()
+            value, end = self.decoder.raw_decode(self.buffer[:end], self.pos)
+
+        self.pos = end
+        return value
+
+    def skip_value(self):
+        '''move past the value at the current position without keeping it'''
+        if self._peek() in '"[{':
+            # the C decoder finds the end of a value that is entirely in the
+            # buffer faster than _scan, even though it builds the value
+            try:
+                self.pos = self.decoder.raw_decode(self.buffer, self.pos)[1]
+                return
+            except ValueError:
+                if self.eof:
+                    raise
+
+        self.pos = self._scan()
+
+    def iterobject(self):
+        '''yield the keys of the object at the current position; the caller
+        must read or skip each value before asking for the next key'''
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.read_value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def iterarray(self):
+        '''yield once per element of the array at the current position; the
+        caller must read or skip each element'''
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield
+            if self._expect(',]') == ']':
+                return
+
+    def resources(self, types):
+        '''yield (module name, key, resource) for resources of `types`
+
+        Both the legacy layout (`modules[].resources{}` with flattened
+        attributes) and the Terraform 0.12+ layout (`resources[].instances[]`
+        with native attributes) are understood.
+        '''
+        for key in self.iterobject():
+            if key == 'modules':
+                for _ in self.iterarray():
+                    for resource in self._module(types):
+                        yield resource
+            elif key == 'resources':
+                for _ in self.iterarray():
+                    # a whole resource is decoded faster in C than its mode
+                    # and type could be read first to skip its instances
+                    resource = self.read_value()
+                    if resource.get('mode') == 'managed' and \
+                            resource.get('type') in types:
+                        self.decoded[resource['type']] += 1
+                    else:
+                        self.skipped[resource.get('type')] += 1
+                    for instance in _instances(resource, types):
+                        yield instance
+            else:
+                self.skip_value()
+
+    def _module(self, types):
+        path = None
+        pending = []
+        for key in self.iterobject():
+            if key == 'path':
+                path = self.read_value()
+            elif key == 'resources':
+                for name in self.iterobject():
+                    resource_type = name.split('.', 1)[0]
+                    if resource_type not in types:
+                        self.skipped[resource_type] += 1
+                        self.skip_value()
+                        continue
+
+                    self.decoded[resource_type] += 1
+                    if path is None:
+                        pending.append((name, self.read_value()))
+                    else:
+                        yield path[-1], name, self.read_value()
+            else:
+                self.skip_value()
+
+        # resources listed before the module path
+        for name, resource in pending:
+            yield path[-1], name, resource
+
+
+def _module_name(address):
+    '''return the innermost module name of a 0.12+ module address like
+    `module.network.module.subnets["a"]`'''
+    if not address:
+        return 'root'
+
+    return re.findall(r'module\.([^.\[]+)', address)[-1]
+
+
+def _instances(resource, types):
+    '''yield (module name, key, resource) for each current instance of a
+    0.12+ resource, in the same shape as a legacy resource'''
+    if resource.get('mode') != 'managed' or resource['type'] not in types:
+        return
+
+    module_name = _module_name(resource.get('module'))
+    prefix = '%s.%s' % (resource['type'], resource['name'])
+    for instance in resource.get('instances', ()):
+        if instance.get('deposed'):
+            continue
+
+        key = prefix
+        if instance.get('index_key') is not None:
+            key = '%s.%s' % (prefix, instance['index_key'])
+
+        attributes = NestedAttributes(instance.get('attributes') or {})
+        yield module_name, key, {
+            'type': resource['type'],
+            'primary': {'id': attributes.get('id'), 'attributes': attributes},
+        }
+
+
+def iterresources(filenames):
+    for filename in filenames:
+        with io.open(filename, 'r', encoding='utf-8') as state_file:
+            reader = StateReader(state_file)
+            for resource in reader.resources(PARSERS):
+                yield resource
+
+        if profiler.enabled:
+            for resource_type, count in reader.decoded.items():
+                profiler.count('decoded ' + resource_type, count)
+            for resource_type, count in reader.skipped.items():
+                profiler.count('skipped %s' % resource_type, count)
+
+
+# CACHE
+def default_cache_dir():
+    return os.environ.get('TF_INVENTORY_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'terraform.py'))
+
+
+# bump when what is parsed from a state file changes, to invalidate caches
+CACHE_FORMAT = 2
+
+
+def _state_signature(filename):
+    '''identify one revision of a state file without reading it'''
+    stat = os.stat(filename)
+    return [VERSION, CACHE_FORMAT, os.path.abspath(filename), stat.st_mtime,
+            stat.st_size]
+
+
+def _cache_path(cache_dir, filename):
+    import hashlib
+    digest = hashlib.sha1(os.path.abspath(filename).encode('utf-8'))
+    return os.path.join(cache_dir, digest.hexdigest() + '.json')
+
+
+def read_cache(cache_dir, filename, signature):
+    '''return the cached hosts for filename, or None if missing or stale'''
+    try:
+        with open(_cache_path(cache_dir, filename), 'r') as json_file:
+            entry = json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if entry.get('signature') != signature:
+        return None
+
+    return [(name, HostVars(attrs), [_intern(group) for group in groups])
+            for name, attrs, groups in entry['hosts']]
+
+
+def _write_json(path, data):
+    '''atomically replace path with data, ignoring failures'''
+    import tempfile
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump(data, json_file, default=_jsonable)
+        os.rename(tmpname, path)
+    except (IOError, OSError):
+        pass
+
+
+def write_cache(cache_dir, filename, signature, hosts):
+    '''store the parsed hosts for filename'''
+    _write_json(_cache_path(cache_dir, filename),
+                {'signature': signature, 'hosts': hosts})
+
+
+def filehosts(filename):
+    '''parse every host defined in a single state file'''
+    hosts = list(iterhosts(iterresources([filename])))
+    workspace = _workspace(filename)
+    if workspace is not None:
+        group = _intern('workspace=' + workspace)
+        for _, _, groups in hosts:
+            groups.append(group)
+
+    return hosts
+
+
+def loadhosts(filenames, cache_dir=None, jobs=1):
+    '''yield host tuples for each state file, reusing cached parse results
+    for files whose path, mtime and size are unchanged
+
+    Files that have to be parsed are spread over a pool of `jobs` worker
+    processes. Hosts are always yielded in the order of `filenames`.
+    '''
+    filenames = list(filenames)
+    cached = {}
+    signatures = {}
+    pending = []
+    for filename in filenames:
+        if cache_dir is not None:
+            signatures[filename] = _state_signature(filename)
+            with profiler.span('read cache', file=filename) as details:
+                hosts = read_cache(cache_dir, filename, signatures[filename])
+                details['hit'] = hosts is not None
+            if hosts is not None:
+                cached[filename] = hosts
+                continue
+        pending.append(filename)
+
+    pool = None
+    if jobs > 1 and len(pending) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(jobs, len(pending)))
+        parsed = pool.imap(filehosts, pending)
+    else:
+        parsed = (filehosts(filename) for filename in pending)
+
+    try:
+        for filename in filenames:
+            try:
+                hosts = cached[filename]
+            except KeyError:
+                # with a pool this is the wait for the worker's result
+                with profiler.span('load', file=filename) as details:
+                    hosts = next(parsed)
+                    details['hosts'] = len(hosts)
+                if pool is not None:
+                    # groups unpickled from a worker are copies of their own
+                    hosts = [(name, attrs, [_intern(group) for group in groups])
+                             for name, attrs, groups in hosts]
+                if cache_dir is not None:
+                    write_cache(cache_dir, filename, signatures[filename],
+                                hosts)
+
+            for host in hosts:
+                yield host
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+# HOST INDEX
+def _index_path(cache_dir, roots):
+    import hashlib
+    digest = hashlib.sha1(_roots_key(roots).encode('utf-8'))
+    return os.path.join(cache_dir, digest.hexdigest() + '.index.json')
+
+
+def build_index(filenames):
+    '''map each host name to the (state file, module, resource key) that
+    defines it, along with the signatures of the files that were indexed'''
+    index = {'files': {}, 'hosts': {}}
+    for filename in filenames:
+        index['files'][filename] = _state_signature(filename)
+        for module_name, key, resource in iterresources([filename]):
+            host = parse_resource(module_name, key, resource)
+            if host is not None:
+                index['hosts'].setdefault(host[0], [filename, module_name, key])
+
+    return index
+
+
+def load_index(filenames, roots, cache_dir):
+    '''return the persisted index for roots, rebuilding it if any state file
+    was added, removed or changed since it was written'''
+    filenames = list(filenames)
+    path = _index_path(cache_dir, roots)
+    try:
+        with open(path, 'r') as json_file:
+            index = json.load(json_file)
+    except (IOError, OSError, ValueError):
+        index = None
+
+    signatures = dict((filename, _state_signature(filename))
+                      for filename in filenames)
+    if index is None or index.get('files') != signatures:
+        with profiler.span('build index', files=len(filenames)):
+            index = build_index(filenames)
+        _write_json(path, index)
+
+    return index
+
+
+def query_host_indexed(index, target):
+    '''parse only the resource that defines target'''
+    try:
+        filename, target_module, target_key = index['hosts'][target]
+    except KeyError:
+        return {}
+
+    for module_name, key, resource in iterresources([filename]):
+        if module_name == target_module and key == target_key:
+            return parse_resource(module_name, key, resource)[1]
+
+    return {}
+
+
+# SNAPSHOT
+# A snapshot file is a header followed by one (offset, name length, payload
+# length) entry per host in inventory order, the record numbers sorted by
+# host name, and the records themselves: the UTF-8 host name followed by
+# [attrs, groups] encoded with msgpack, or JSON where msgpack is missing.
+SNAPSHOT_MAGIC = b'TFINVSNP'
+_snapshot_header = struct.Struct(str('<8s4sI'))
+_snapshot_entry = struct.Struct(str('<QII'))
+_snapshot_number = struct.Struct(str('<I'))
+
+
+def _msgpack():
+    '''return the msgpack module, or None if it is not installed'''
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def _snapshot_codec(codec):
+    '''return (encode, decode) functions for a snapshot codec'''
+    if codec == b'msgp':
+        msgpack = _msgpack()
+        if msgpack is None:
+            raise ValueError('snapshot is encoded with msgpack, which is not '
+                             'installed')
+        return (lambda value: msgpack.packb(value, use_bin_type=True,
+                                            default=_jsonable),
+                lambda data: msgpack.unpackb(data, raw=False))
+    elif codec == b'json':
+        return (lambda value: json.dumps(value, separators=(',', ':'),
+                                         default=_jsonable).encode('utf-8'),
+                lambda data: json.loads(data.decode('utf-8')))
+
+    raise ValueError('unknown snapshot codec %r' % codec)
+
+
+def write_snapshot(path, hosts):
+    '''atomically write hosts to a snapshot file at path'''
+    import tempfile
+    codec = b'json' if _msgpack() is None else b'msgp'
+    encode = _snapshot_codec(codec)[0]
+    names, payloads = [], []
+    for name, attrs, groups in hosts:
+        names.append(name.encode('utf-8'))
+        payloads.append(encode([attrs, groups]))
+
+    count = len(names)
+    offset = (_snapshot_header.size + count * _snapshot_entry.size +
+              count * _snapshot_number.size)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmpname = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(_snapshot_header.pack(SNAPSHOT_MAGIC, codec, count))
+            for name, payload in zip(names, payloads):
+                out.write(_snapshot_entry.pack(offset, len(name), len(payload)))
+                offset += len(name) + len(payload)
+            for number in sorted(range(count), key=names.__getitem__):
+                out.write(_snapshot_number.pack(number))
+            for name, payload in zip(names, payloads):
+                out.write(name)
+                out.write(payload)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpname, 0o666 & ~umask)
+        os.rename(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+class Snapshot(object):
+    '''the hosts of a snapshot file
+
+    The file is memory-mapped and a host is only decoded when it is
+    iterated over or looked up, so opening even a large snapshot is cheap
+    and find() touches just the pages along a binary search.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        magic, codec, self._count = _snapshot_header.unpack_from(self._map)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('%s is not an inventory snapshot' % path)
+        self._decode = _snapshot_codec(codec)[1]
+        self._sorted = _snapshot_header.size + self._count * _snapshot_entry.size
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for number in range(self._count):
+            yield self._record(number)
+
+    def _entry(self, number):
+        return _snapshot_entry.unpack_from(
+            self._map, _snapshot_header.size + number * _snapshot_entry.size)
+
+    def _name(self, number):
+        offset, name_length, _ = self._entry(number)
+        return self._map[offset:offset + name_length]
+
+    def _record(self, number):
+        offset, name_length, length = self._entry(number)
+        start = offset + name_length
+        attrs, groups = self._decode(self._map[start:start + length])
+        return (self._map[offset:start].decode('utf-8'), HostVars(attrs),
+                [_intern(group) for group in groups])
+
+    def find(self, target):
+        '''return the host tuple for target, or None'''
+        target = target.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            number = _snapshot_number.unpack_from(
+                self._map, self._sorted + middle * _snapshot_number.size)[0]
+            name = self._name(number)
+            if name < target:
+                low = middle + 1
+            elif name > target:
+                high = middle
+            else:
+                return self._record(number)
+
+        return None
+
+    def close(self):
+        self._map.close()
+
+
+# READ RESOURCES
+PARSERS = {}
+
+
+def _clean_dc(dcname):
+    # Consul DCs are strictly alphanumeric with underscores and hyphens -
+    # ensure that the consul_dc attribute meets these requirements.
+    return re.sub('[^\\w_\\-]', '-', dcname)
+
+
+def parse_resource(module_name, key, resource):
+    '''return a host tuple for resource, or None if it is not a host'''
+    resource_type, name = key.split('.', 1)
+    try:
+        parser = PARSERS[resource_type]
+    except KeyError:
+        return None
+
+    primary = resource['primary']
+    if not isinstance(primary['attributes'], (FlatAttributes, NestedAttributes)):
+        primary['attributes'] = FlatAttributes(primary['attributes'])
+
+    if not profiler.enabled:
+        return parser(resource, module_name)
+
+    start = _clock()
+    try:
+        return parser(resource, module_name)
+    finally:
+        profiler.add('parse ' + resource_type, _clock() - start)
+
+
+def iterhosts(resources):
+    '''yield host tuples of (name, attributes, groups)'''
+    for module_name, key, resource in resources:
+        host = parse_resource(module_name, key, resource)
+        if host is not None:
+            yield host
+
+
+def parses(prefix):
+    def inner(func):
+        PARSERS[prefix] = func
+        return func
+
+    return inner
+
+
+_interned = {}
+
+
+def _intern(value):
+    '''share one copy of values that repeat across hosts'''
+    return _interned.setdefault(value, value)
+
+
+class HostVars(object):
+    '''variables of one host
+
+    The fields every parser sets live in slots and only provider-specific
+    extras go into a dict, which keeps thousands of hosts much smaller than
+    the same number of plain dicts. Behaves like a mutable mapping; a plain
+    dict is only built by as_dict() when the host is written out.
+    '''
+    __slots__ = (
+        'ansible_python_interpreter', 'ansible_ssh_host', 'ansible_ssh_port',
+        'ansible_ssh_user', 'consul_dc', 'consul_is_server', 'id',
+        'private_ipv4', 'provider', 'public_ipv4', 'publicly_routable', 'role',
+        'extra',
+    )
+    _fields = frozenset(__slots__[:-1])
+    _shared = frozenset(['ansible_python_interpreter', 'ansible_ssh_user',
+                         'consul_dc', 'provider', 'role'])
+
+    def __init__(self, attrs=()):
+        self.extra = {}
+        self.update(attrs)
+
+    def __reduce__(self):
+        return HostVars, (self.as_dict(),)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            if key in self._shared:
+                value = _intern(value)
+            setattr(self, key, value)
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._fields:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+
+        return True
+
+    def __iter__(self):
+        for key in self.__slots__[:-1]:
+            if hasattr(self, key):
+                yield key
+
+        for key in self.extra:
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, HostVars):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'HostVars(%r)' % self.as_dict()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def update(self, attrs):
+        for key, value in dict(attrs).items():
+            self[key] = value
+
+    def as_dict(self):
+        return dict(self.items())
+
+
+def _jsonable(obj):
+    '''json `default` hook for HostVars'''
+    if isinstance(obj, HostVars):
+        return obj.as_dict()
+
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def calculate_mantl_vars(func):
+    """calculate Mantl vars"""
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        name, attrs, groups = func(*args, **kwargs)
+
+        # attrs
+        if attrs.get('role', '') == 'control':
+            attrs['consul_is_server'] = True
+        else:
+            attrs['consul_is_server'] = False
+
+        # groups
+        if attrs.get('publicly_routable', False):
+            groups.append('publicly_routable')
+
+        return name, HostVars(attrs), [_intern(group) for group in groups]
+
+    return inner
+
+
+class FlatAttributes(dict):
+    '''flattened Terraform attributes (`a.b.c` keys) with a prefix index
+
+    The index for a separator is built in a single pass over the attributes
+    the first time it is needed, after which every parse_* helper is a
+    lookup. It is not updated if the attributes are modified afterwards.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(FlatAttributes, self).__init__(*args, **kwargs)
+        self._indexes = {}
+
+    def prefixed(self, prefix, sep='.'):
+        '''return (rest, value) pairs for the keys `prefix<sep>rest`'''
+        try:
+            index = self._indexes[sep]
+        except KeyError:
+            index = self._indexes[sep] = self._build_index(sep)
+
+        return index.get(prefix, ())
+
+    def _build_index(self, sep):
+        index = defaultdict(list)
+        for compkey, value in self.items():
+            try:
+                curprefix, rest = compkey.split(sep, 1)
+            except ValueError:
+                continue
+
+            # list and map sizes
+            if rest in ('#', '%'):
+                continue
+
+            index[curprefix].append((rest, value))
+
+        return index
+
+
+def _flat_value(value):
+    '''render a native attribute value the way Terraform's flatmap does'''
+    if value is None:
+        return ''
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    elif isinstance(value, (int, float)):
+        return '%s' % value
+
+    return value
+
+
+def _flatten(value, prefix=''):
+    '''yield (key, value) pairs for a nested value, flatmap style'''
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = ((str(idx), item) for idx, item in enumerate(value))
+    else:
+        yield prefix, _flat_value(value)
+        return
+
+    for key, item in items:
+        if item is not None:
+            for pair in _flatten(item, prefix + '.' + key if prefix else key):
+                yield pair
+
+
+class NestedAttributes(object):
+    '''native attributes of a Terraform 0.12+ resource instance, read as if
+    they were flattened
+
+    Dotted keys are looked up by walking the nested values, and only the
+    values below a prefix that a parse_* helper asks for are flattened.
+    '''
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self._prefixes = {}
+
+    def _lookup(self, compkey):
+        value = self.attributes
+        for key in compkey.split('.'):
+            if isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                value = value[int(key)]
+            elif isinstance(value, dict) and key in value:
+                value = value[key]
+            else:
+                raise KeyError(compkey)
+
+        if isinstance(value, (dict, list)):
+            raise KeyError(compkey)
+
+        return _flat_value(value)
+
+    def __getitem__(self, compkey):
+        return self._lookup(compkey)
+
+    def __contains__(self, compkey):
+        try:
+            self._lookup(compkey)
+        except KeyError:
+            return False
+
+        return True
+
+    def get(self, compkey, default=None):
+        try:
+            return self._lookup(compkey)
+        except KeyError:
+            return default
+
+    def prefixed(self, prefix, sep='.'):
+        '''return (rest, value) pairs for the keys `prefix<sep>rest`'''
+        try:
+            return self._prefixes[prefix, sep]
+        except KeyError:
+            pass
+
+        if sep == '.':
+            value = self.attributes.get(prefix)
+            pairs = [] if value is None else list(_flatten(value))
+            # a scalar has no keys below it
+            pairs = [(rest, item) for rest, item in pairs if rest]
+        else:
+            pairs = []
+            for key, value in self.attributes.items():
+                curprefix, _, rest = key.partition(sep)
+                if curprefix == prefix and rest:
+                    pairs.extend(_flatten(value, rest))
+
+        self._prefixes[prefix, sep] = pairs
+        return pairs
+
+
+def _parse_prefix(source, prefix, sep='.'):
+    if not isinstance(source, (FlatAttributes, NestedAttributes)):
+        source = FlatAttributes(source)
+
+    return source.prefixed(prefix, sep)
+
+
+def parse_attr_list(source, prefix, sep='.'):
+    attrs = defaultdict(dict)
+    for compkey, value in _parse_prefix(source, prefix, sep):
+        idx, key = compkey.split(sep, 1)
+        attrs[idx][key] = value
+
+    return list(attrs.values())
+
+
+def parse_dict(source, prefix, sep='.'):
+    return dict(_parse_prefix(source, prefix, sep))
+
+
+def parse_list(source, prefix, sep='.'):
+    return [value for _, value in _parse_prefix(source, prefix, sep)]
+
+
+def parse_bool(string_form):
+    token = string_form.lower()[0]
+
+    if token == 't':
+        return True
+    elif token == 'f':
+        return False
+    else:
+        raise ValueError('could not convert %r to a bool' % string_form)
+
+
+@parses('triton_machine')
+@calculate_mantl_vars
+def triton_machine(resource, module_name):
+    raw_attrs = resource['primary']['attributes']
+    name = raw_attrs.get('name')
+    groups = []
+
+    attrs = {
+        'id': raw_attrs['id'],
+        'dataset': raw_attrs['dataset'],
+        'disk': raw_attrs['disk'],
+        'firewall_enabled': parse_bool(raw_attrs['firewall_enabled']),
+        'image': raw_attrs['image'],
+        'ips': parse_list(raw_attrs, 'ips'),
+        'memory': raw_attrs['memory'],
+        'name': raw_attrs['name'],
+        'networks': parse_list(raw_attrs, 'networks'),
+        'package': raw_attrs['package'],
+        'primary_ip': raw_attrs['primaryip'],
+        'root_authorized_keys': raw_attrs['root_authorized_keys'],
+        'state': raw_attrs['state'],
+        'tags': parse_dict(raw_attrs, 'tags'),
+        'type': raw_attrs['type'],
+        'user_data': raw_attrs['user_data'],
+        'user_script': raw_attrs['user_script'],
+
+        # ansible
+        'ansible_ssh_host': raw_attrs['primaryip'],
+        'ansible_ssh_port': 22,
+        'ansible_ssh_user': 'root',  # it's "root" on Triton by defaul
+
+        # generic
+        'public_ipv4': raw_attrs['primaryip'],
+        'provider': 'triton',
+    }
+
+    # private IPv4
+    for ip in attrs['ips']:
+        if ip.startswith('10') or ip.startswith('192.168'):  # private IPs
+            attrs['private_ipv4'] = ip
+            break
+
+    if 'private_ipv4' not in attrs:
+        attrs['private_ipv4'] = attrs['public_ipv4']
+
+    # attrs specific to Mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['tags'].get('dc', 'none')),
+        'role': attrs['tags'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['tags'].get('python_bin', 'python')
+    })
+
+    # add groups based on attrs
+    groups.append('triton_image=' + attrs['image'])
+    groups.append('triton_package=' + attrs['package'])
+    groups.append('triton_state=' + attrs['state'])
+    groups.append('triton_firewall_enabled=%s' % attrs['firewall_enabled'])
+    groups.extend('triton_tags_%s=%s' % item
+                  for item in attrs['tags'].items())
+    groups.extend('triton_network=' + network
+                  for network in attrs['networks'])
+
+    # groups specific to Mantl
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('digitalocean_droplet')
+@calculate_mantl_vars
+def digitalocean_host(resource, tfvars=None):
+    raw_attrs = resource['primary']['attributes']
+    name = raw_attrs['name']
+    groups = []
+
+    attrs = {
+        'id': raw_attrs['id'],
+        'image': raw_attrs['image'],
+        'ipv4_address': raw_attrs['ipv4_address'],
+        'locked': parse_bool(raw_attrs['locked']),
+        'metadata': json.loads(raw_attrs.get('user_data', '{}')),
+        'region': raw_attrs['region'],
+        'size': raw_attrs['size'],
+        'ssh_keys': parse_list(raw_attrs, 'ssh_keys'),
+        'status': raw_attrs['status'],
+        # ansible
+        'ansible_ssh_host': raw_attrs['ipv4_address'],
+        'ansible_ssh_port': 22,
+        'ansible_ssh_user': 'root',  # it's always "root" on DO
+        # generic
+        'public_ipv4': raw_attrs['ipv4_address'],
+        'private_ipv4': raw_attrs.get('ipv4_address_private',
+                                      raw_attrs['ipv4_address']),
+        'provider': 'digitalocean',
+    }
+
+    # attrs specific to Mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('dc', attrs['region'])),
+        'role': attrs['metadata'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['metadata'].get('python_bin', 'python')
+    })
+
+    # add groups based on attrs
+    groups.append('do_image=' + attrs['image'])
+    groups.append('do_locked=%s' % attrs['locked'])
+    groups.append('do_region=' + attrs['region'])
+    groups.append('do_size=' + attrs['size'])
+    groups.append('do_status=' + attrs['status'])
+    groups.extend('do_metadata_%s=%s' % item
+                  for item in attrs['metadata'].items())
+
+    # groups specific to Mantl
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('softlayer_virtualserver')
+@calculate_mantl_vars
+def softlayer_host(resource, module_name):
+    raw_attrs = resource['primary']['attributes']
+    name = raw_attrs['name']
+    groups = []
+
+    attrs = {
+        'id': raw_attrs['id'],
+        'image': raw_attrs['image'],
+        'ipv4_address': raw_attrs['ipv4_address'],
+        'metadata': json.loads(raw_attrs.get('user_data', '{}')),
+        'region': raw_attrs['region'],
+        'ram': raw_attrs['ram'],
+        'cpu': raw_attrs['cpu'],
+        'ssh_keys': parse_list(raw_attrs, 'ssh_keys'),
+        'public_ipv4': raw_attrs['ipv4_address'],
+        'private_ipv4': raw_attrs['ipv4_address_private'],
+        'ansible_ssh_host': raw_attrs['ipv4_address'],
+        'ansible_ssh_port': 22,
+        'ansible_ssh_user': 'root',
+        'provider': 'softlayer',
+    }
+
+    # attrs specific to Mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('dc', attrs['region'])),
+        'role': attrs['metadata'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['metadata'].get('python_bin', 'python')
+    })
+
+    # groups specific to Mantl
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('openstack_compute_instance_v2')
+@calculate_mantl_vars
+def openstack_host(resource, module_name):
+    raw_attrs = resource['primary']['attributes']
+    name = raw_attrs['name']
+    groups = []
+
+    attrs = {
+        'access_ip_v4': raw_attrs['access_ip_v4'],
+        'access_ip_v6': raw_attrs['access_ip_v6'],
+        'flavor': parse_dict(raw_attrs, 'flavor',
+                             sep='_'),
+        'id': raw_attrs['id'],
+        'image': parse_dict(raw_attrs, 'image',
+                            sep='_'),
+        'key_pair': raw_attrs['key_pair'],
+        'metadata': parse_dict(raw_attrs, 'metadata'),
+        'network': parse_attr_list(raw_attrs, 'network'),
+        'region': raw_attrs.get('region', ''),
+        'security_groups': parse_list(raw_attrs, 'security_groups'),
+        # ansible
+        'ansible_ssh_port': 22,
+        # workaround for an OpenStack bug where hosts have a different domain
+        # after they're restarted
+        'host_domain': 'novalocal',
+        'use_host_domain': True,
+        # generic
+        'public_ipv4': raw_attrs['access_ip_v4'],
+        'private_ipv4': raw_attrs['access_ip_v4'],
+        'provider': 'openstack',
+    }
+
+    if 'floating_ip' in raw_attrs:
+        attrs['private_ipv4'] = raw_attrs['network.0.fixed_ip_v4']
+
+    try:
+        attrs.update({
+            'ansible_ssh_host': raw_attrs['access_ip_v4'],
+            'publicly_routable': True,
+        })
+    except (KeyError, ValueError):
+        attrs.update({'ansible_ssh_host': '', 'publicly_routable': False})
+
+    # attrs specific to Ansible
+    if 'metadata.ssh_user' in raw_attrs:
+        attrs['ansible_ssh_user'] = raw_attrs['metadata.ssh_user']
+
+    # attrs specific to Mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('dc', module_name)),
+        'role': attrs['metadata'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['metadata'].get('python_bin', 'python')
+    })
+
+    # add groups based on attrs
+    groups.append('os_image=' + attrs['image']['name'])
+    groups.append('os_flavor=' + attrs['flavor']['name'])
+    groups.extend('os_metadata_%s=%s' % item
+                  for item in attrs['metadata'].items())
+    groups.append('os_region=' + attrs['region'])
+
+    # groups specific to Mantl
+    groups.append('role=' + attrs['metadata'].get('role', 'none'))
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('aws_instance')
+@calculate_mantl_vars
+def aws_host(resource, module_name):
+    name = resource['primary']['attributes']['tags.Name']
+    raw_attrs = resource['primary']['attributes']
+
+    groups = []
+
+    attrs = {
+        'ami': raw_attrs['ami'],
+        'availability_zone': raw_attrs['availability_zone'],
+        'ebs_block_device': parse_attr_list(raw_attrs, 'ebs_block_device'),
+        'ebs_optimized': parse_bool(raw_attrs['ebs_optimized']),
+        'ephemeral_block_device': parse_attr_list(raw_attrs,
+                                                  'ephemeral_block_device'),
+        'id': raw_attrs['id'],
+        'key_name': raw_attrs['key_name'],
+        'private': parse_dict(raw_attrs, 'private',
+                              sep='_'),
+        'public': parse_dict(raw_attrs, 'public',
+                             sep='_'),
+        'root_block_device': parse_attr_list(raw_attrs, 'root_block_device'),
+        'security_groups': parse_list(raw_attrs, 'security_groups'),
+        'subnett': parse_dict(raw_attrs, 'subnett',
+                             sep='_'),
+        'tags': parse_dict(raw_attrs, 'tags'),
+        'tenancy': raw_attrs['tenancy'],
+        'vpc_security_group_ids': parse_list(raw_attrs,
+                                             'vpc_security_group_ids'),
+        # ansible-specific
+        'ansible_ssh_port': 22,
+        'ansible_ssh_host': raw_attrs['public_ip'],
+        # generic
+        'public_ipv4': raw_attrs['public_ip'],
+        'private_ipv4': raw_attrs['private_ip'],
+        'provider': 'aws',
+    }
+
+    # attrs specific to Ansible
+    if 'tags.sshUser' in raw_attrs:
+        attrs['ansible_ssh_user'] = raw_attrs['tags.sshUser']
+    if 'tags.sshPrivateIp' in raw_attrs:
+        attrs['ansible_ssh_host'] = raw_attrs['private_ip']
+
+    # attrs specific to Mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['tags'].get('dc', module_name)),
+        'role': attrs['tags'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['tags'].get('python_bin', 'python')
+    })
+
+    # groups specific to Mantl
+    groups.extend(['aws_ami=' + attrs['ami'],
+                   'aws_az=' + attrs['availability_zone'],
+                   'aws_key_name=' + attrs['key_name'],
+                   'aws_tenancy=' + attrs['tenancy']])
+    groups.extend('aws_tag_%s=%s' % item for item in attrs['tags'].items())
+    groups.extend('aws_vpc_security_group=' + group
+                  for group in attrs['vpc_security_group_ids'])
+    groups.extend('aws_subnett_%s=%s' % subnet
+                  for subnett in attrs['subnett'].items())
+
+    # groups specific to Mantl
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('google_compute_instance')
+@calculate_mantl_vars
+def gce_host(resource, module_name):
+    name = resource['primary']['id']
+    raw_attrs = resource['primary']['attributes']
+    groups = []
+
+    # network interfaces
+    interfaces = parse_attr_list(raw_attrs, 'network_interface')
+    for interface in interfaces:
+        interface['access_config'] = parse_attr_list(interface,
+                                                     'access_config')
+        for key in list(interface.keys()):
+            if '.' in key:
+                del interface[key]
+
+    # general attrs
+    attrs = {
+        'can_ip_forward': raw_attrs['can_ip_forward'] == 'true',
+        'disks': parse_attr_list(raw_attrs, 'disk'),
+        'machine_type': raw_attrs['machine_type'],
+        'metadata': parse_dict(raw_attrs, 'metadata'),
+        'network': parse_attr_list(raw_attrs, 'network'),
+        'network_interface': interfaces,
+        'self_link': raw_attrs['self_link'],
+        'service_account': parse_attr_list(raw_attrs, 'service_account'),
+        'tags': parse_list(raw_attrs, 'tags'),
+        'zone': raw_attrs['zone'],
+        # ansible
+        'ansible_ssh_port': 22,
+        'provider': 'gce',
+    }
+
+    # attrs specific to Ansible
+    if 'metadata.ssh_user' in raw_attrs:
+        attrs['ansible_ssh_user'] = raw_attrs['metadata.ssh_user']
+
+    # attrs specific to Mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('dc', module_name)),
+        'role': attrs['metadata'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['metadata'].get('python_bin', 'python')
+    })
+
+    try:
+        attrs.update({
+            'ansible_ssh_host': interfaces[0]['access_config'][0]['nat_ip'] or interfaces[0]['access_config'][0]['assigned_nat_ip'],
+            'public_ipv4': interfaces[0]['access_config'][0]['nat_ip'] or interfaces[0]['access_config'][0]['assigned_nat_ip'],
+            'private_ipv4': interfaces[0]['address'],
+            'publicly_routable': True,
+        })
+    except (KeyError, ValueError):
+        attrs.update({'ansible_ssh_host': '', 'publicly_routable': False})
+
+    # add groups based on attrs
+    groups.extend('gce_image=' + disk['image'] for disk in attrs['disks'])
+    groups.append('gce_machine_type=' + attrs['machine_type'])
+    groups.extend('gce_metadata_%s=%s' % (key, value)
+                  for (key, value) in attrs['metadata'].items()
+                  if key not in set(['sshKeys']))
+    groups.extend('gce_tag=' + tag for tag in attrs['tags'])
+    groups.append('gce_zone=' + attrs['zone'])
+
+    if attrs['can_ip_forward']:
+        groups.append('gce_ip_forward')
+    if attrs['publicly_routable']:
+        groups.append('gce_publicly_routable')
+
+    # groups specific to Mantl
+    groups.append('role=' + attrs['metadata'].get('role', 'none'))
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('vsphere_virtual_machine')
+@calculate_mantl_vars
+def vsphere_host(resource, module_name):
+    raw_attrs = resource['primary']['attributes']
+    network_attrs = parse_dict(raw_attrs, 'network_interface')
+    network = parse_dict(network_attrs, '0')
+    ip_address = network.get('ipv4_address', network['ip_address'])
+    name = raw_attrs['name']
+    groups = []
+
+    attrs = {
+        'id': raw_attrs['id'],
+        'ip_address': ip_address,
+        'private_ipv4': ip_address,
+        'public_ipv4': ip_address,
+        'metadata': parse_dict(raw_attrs, 'custom_configuration_parameters'),
+        'ansible_ssh_port': 22,
+        'provider': 'vsphere',
+    }
+
+    try:
+        attrs.update({
+            'ansible_ssh_host': ip_address,
+        })
+    except (KeyError, ValueError):
+        attrs.update({'ansible_ssh_host': '', })
+
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('consul_dc', module_name)),
+        'role': attrs['metadata'].get('role', 'none'),
+        'ansible_python_interpreter': attrs['metadata'].get('python_bin', 'python')
+    })
+
+    # attrs specific to Ansible
+    if 'ssh_user' in attrs['metadata']:
+        attrs['ansible_ssh_user'] = attrs['metadata']['ssh_user']
+
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('azure_instance')
+@calculate_mantl_vars
+def azure_host(resource, module_name):
+    name = resource['primary']['attributes']['name']
+    raw_attrs = resource['primary']['attributes']
+
+    groups = []
+
+    attrs = {
+        'automatic_updates': raw_attrs['automatic_updates'],
+        'description': raw_attrs['description'],
+        'hosted_service_name': raw_attrs['hosted_service_name'],
+        'id': raw_attrs['id'],
+        'image': raw_attrs['image'],
+        'ip_address': raw_attrs['ip_address'],
+        'location': raw_attrs['location'],
+        'name': raw_attrs['name'],
+        'reverse_dns': raw_attrs['reverse_dns'],
+        'security_group': raw_attrs['security_group'],
+        'size': raw_attrs['size'],
+        'ssh_key_thumbprint': raw_attrs['ssh_key_thumbprint'],
+        'subnett': raw_attrs['subnett'],
+        'username': raw_attrs['username'],
+        'vip_address': raw_attrs['vip_address'],
+        'virtual_network': raw_attrs['virtual_network'],
+        'endpoint': parse_attr_list(raw_attrs, 'endpoint'),
+        # ansible
+        'ansible_ssh_port': 22,
+        'ansible_ssh_user': raw_attrs['username'],
+        'ansible_ssh_host': raw_attrs['vip_address'],
+    }
+
+    # attrs specific to mantl
+    attrs.update({
+        'consul_dc': attrs['location'].lower().replace(" ", "-"),
+        'role': attrs['description']
+    })
+
+    # groups specific to mantl
+    groups.extend(['azure_image=' + attrs['image'],
+                   'azure_location=' + attrs['location'].lower().replace(" ", "-"),
+                   'azure_username=' + attrs['username'],
+                   'azure_security_group=' + attrs['security_group']])
+
+    # groups specific to mantl
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+
+@parses('clc_server')
+@calculate_mantl_vars
+def clc_server(resource, module_name):
+    raw_attrs = resource['primary']['attributes']
+    name = raw_attrs.get('id')
+    groups = []
+    md = parse_dict(raw_attrs, 'metadata')
+    attrs = {
+        'metadata': md,
+        'ansible_ssh_port': md.get('ssh_port', 22),
+        'ansible_ssh_user': md.get('ssh_user', 'root'),
+        'provider': 'clc',
+        'publicly_routable': False,
+    }
+
+    try:
+        attrs.update({
+            'public_ipv4': raw_attrs['public_ip_address'],
+            'private_ipv4': raw_attrs['private_ip_address'],
+            'ansible_ssh_host': raw_attrs['public_ip_address'],
+            'publicly_routable': True,
+        })
+    except (KeyError, ValueError):
+        attrs.update({
+            'ansible_ssh_host': raw_attrs['private_ip_address'],
+            'private_ipv4': raw_attrs['private_ip_address'],
+        })
+
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('dc', module_name)),
+        'role': attrs['metadata'].get('role', 'none'),
+    })
+
+    groups.append('role=' + attrs['role'])
+    groups.append('dc=' + attrs['consul_dc'])
+    return name, attrs, groups
+
+
+@parses('ucs_service_profile')
+@calculate_mantl_vars
+def ucs_host(resource, module_name):
+    name = resource['primary']['id']
+    raw_attrs = resource['primary']['attributes']
+    groups = []
+
+    # general attrs
+    attrs = {
+        'metadata': parse_dict(raw_attrs, 'metadata'),
+        'provider': 'ucs',
+    }
+
+    # attrs specific to mantl
+    attrs.update({
+        'consul_dc': _clean_dc(attrs['metadata'].get('dc', module_name)),
+        'role': attrs['metadata'].get('role', 'none'),
+    })
+
+    try:
+        attrs.update({
+            'ansible_ssh_host': raw_attrs['vNIC.0.ip'],
+            'public_ipv4': raw_attrs['vNIC.0.ip'],
+            'private_ipv4': raw_attrs['vNIC.0.ip']
+        })
+    except (KeyError, ValueError):
+        attrs.update({'ansible_ssh_host': '', 'publicly_routable': False})
+
+    # add groups based on attrs
+    groups.append('role=' + attrs['role'])  # .get('role', 'none'))
+
+    # groups.append('all:children')
+    groups.append('dc=' + attrs['consul_dc'])
+
+    return name, attrs, groups
+
+# QUERY TYPES
+
+
+def query_host(hosts, target):
+    for name, attrs, _ in hosts:
+        if name == target:
+            return attrs
+
+    return {}
+
+
+class GroupIndex(object):
+    '''group memberships of a sequence of hosts
+
+    Each group keeps an array of host positions instead of a list of names,
+    so grouping costs memory per distinct group rather than per host and
+    group; the name lists are only built by groups().
+    '''
+
+    def __init__(self):
+        self.names = []
+        self.members = {}
+
+    def add(self, name, hostgroups):
+        position = len(self.names)
+        self.names.append(name)
+        for group in hostgroups:
+            try:
+                members = self.members[group]
+            except KeyError:
+                members = self.members[group] = array(str('I'))
+
+            # a host may list the same group twice
+            if not members or members[-1] != position:
+                members.append(position)
+
+    def groups(self):
+        '''yield (group, host names) pairs'''
+        names = self.names
+        for group, members in self.members.items():
+            yield group, [names[position] for position in members]
+
+
+def query_list(hosts):
+    index = GroupIndex()
+    meta = {}
+
+    for name, attrs, hostgroups in hosts:
+        index.add(name, hostgroups)
+        meta[name] = attrs
+
+    groups = defaultdict(dict)
+    for group, names in index.groups():
+        groups[group]['hosts'] = names
+
+    groups['_meta'] = {'hostvars': meta}
+    return groups
+
+
+# variables that are usually the same for every host of a datacenter or role
+FACTORED_VARS = ('ansible_python_interpreter', 'ansible_ssh_user', 'consul_dc',
+                 'consul_is_server', 'provider', 'role')
+
+
+def _placement(hostgroups):
+    '''return the dc=, role= and dc=_role= groups of a host, None where a host
+    is not in exactly one'''
+    dcs = set(group for group in hostgroups if group.startswith('dc='))
+    roles = set(group for group in hostgroups if group.startswith('role='))
+    dc = dcs.pop() if len(dcs) == 1 else None
+    role = roles.pop() if len(roles) == 1 else None
+    pair = _intern(dc + '_' + role) if dc and role else None
+    return dc, role, pair
+
+
+def query_hierarchical(hosts):
+    '''like query_list, but with shared variables moved into group vars
+
+    Hosts in both a dc= and a role= group are listed in a dc=X_role=Y group,
+    which is a child of both. Each of FACTORED_VARS is moved to the vars of
+    the dc=, role= or dc=_role= groups, whichever level takes it off the most
+    hosts, for every group of that level whose hosts all share one value.
+    Hosts in any other group of that level keep it in their hostvars. Using a
+    single level per variable means no two groups of a host ever define the
+    same variable, so Ansible's group precedence never comes into play; a
+    group with a host that is also in another group of its level is left
+    alone for the same reason.
+    '''
+    index = GroupIndex()
+    children = defaultdict(set)
+    placements = []
+    unplaced = []
+    meta = {}
+
+    for name, attrs, hostgroups in hosts:
+        placement = _placement(hostgroups)
+        dc, role, pair = placement
+        # the dc= or role= groups of a host that is in several of them
+        unplaced.append([set(group for group in hostgroups
+                             if group.startswith(prefix) and placed is None)
+                         for prefix, placed in (('dc=', dc), ('role=', role))])
+        if pair is not None:
+            children[dc].add(pair)
+            children[role].add(pair)
+            hostgroups = [group for group in hostgroups
+                          if group != dc and group != role]
+            hostgroups.append(pair)
+        index.add(name, hostgroups)
+        placements.append(placement)
+        meta[name] = attrs.as_dict() if isinstance(attrs, HostVars) \
+            else dict(attrs)
+
+    names = index.names
+    groups = defaultdict(dict)
+    for key in FACTORED_VARS:
+        best, best_saved = None, 0
+        for level in range(3):
+            values, mixed = {}, set()
+            for name, placement, others in zip(names, placements, unplaced):
+                group = placement[level]
+                if group is None:
+                    # such a host would get the variable from each of them
+                    if level < 2:
+                        mixed.update(others[level])
+                    continue
+                if group in mixed:
+                    continue
+                hostvars = meta[name]
+                if key not in hostvars:
+                    mixed.add(group)
+                    continue
+                value = values.setdefault(group, hostvars[key])
+                if value != hostvars[key]:
+                    mixed.add(group)
+
+            for group in mixed:
+                values.pop(group, None)
+            saved = sum(1 for placement in placements
+                        if placement[level] in values)
+            if saved > best_saved:
+                best, best_saved = (level, values), saved
+
+        if best is None:
+            continue
+
+        level, values = best
+        for group, value in values.items():
+            groups[group].setdefault('vars', {})[key] = value
+        for name, placement in zip(names, placements):
+            if placement[level] in values:
+                del meta[name][key]
+
+    for group, members in index.groups():
+        groups[group]['hosts'] = members
+    for group, members in children.items():
+        groups[group]['children'] = sorted(members)
+
+    groups['_meta'] = {'hostvars': meta}
+    return groups
+
+
+def query_hostfile(hosts):
+    out = ['## begin hosts generated by terraform.py ##']
+    out.extend(
+        '{}\t{}'.format(attrs['ansible_ssh_host'].ljust(16), name)
+        for name, attrs, _ in hosts
+    )
+
+    out.append('## end hosts generated by terraform.py ##')
+    return '\n'.join(out)
+
+
+def host_hash(attrs, groups):
+    '''content hash of a host's variables and groups'''
+    import hashlib
+    content = json.dumps([attrs, sorted(set(groups))], sort_keys=True,
+                         default=_jsonable)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def host_hashes(hosts):
+    return dict((name, host_hash(attrs, groups))
+                for name, attrs, groups in hosts)
+
+
+def query_changed(hosts, snapshot):
+    '''compare hosts with the host hashes recorded in snapshot'''
+    current = host_hashes(hosts)
+    return {
+        'added': sorted(set(current) - set(snapshot)),
+        'removed': sorted(set(snapshot) - set(current)),
+        'modified': sorted(name for name in set(current) & set(snapshot)
+                           if current[name] != snapshot[name]),
+    }
+
+
+def write_list(hosts, out, pretty=False, nometa=False):
+    '''write the --list inventory for hosts to out while they are produced
+
+    Each host's variables are written under _meta as soon as the host is
+    parsed and are not kept afterwards; only group memberships are held until
+    the groups are written at the end.
+    '''
+    if pretty:
+        encode = json.JSONEncoder(indent=4, separators=(',', ': '),
+                                  default=_jsonable).encode
+
+        def member(value, depth):
+            return encode(value).replace('\n', '\n' + ' ' * 4 * depth)
+
+        def newline(depth):
+            return '\n' + ' ' * 4 * depth
+    else:
+        encode = json.JSONEncoder(default=_jsonable).encode
+
+        def member(value, depth):
+            return encode(value)
+
+        def newline(depth):
+            return ''
+
+    sep = ',' if pretty else ', '
+    index = GroupIndex()
+
+    out.write('{')
+    if not nometa:
+        out.write('%s"_meta": {%s"hostvars": {' % (newline(1), newline(2)))
+    first = True
+    for name, attrs, hostgroups in hosts:
+        index.add(name, hostgroups)
+        if not nometa:
+            out.write('%s%s%s: %s' % ('' if first else sep, newline(3),
+                                      encode(name), member(attrs, 3)))
+            first = False
+
+    if not nometa:
+        # json.dumps writes empty objects as {} even when indenting
+        out.write('%s}%s}' % ('' if first else newline(2), newline(1)))
+    first = nometa
+    for group, names in index.groups():
+        out.write('%s%s%s: %s' % ('' if first else sep, newline(1),
+                                  encode(group), member({'hosts': names}, 1)))
+        first = False
+
+    out.write('%s}' % ('' if first else newline(0)))
+
+
+def render(request, hosts):
+    '''format the response to an inventory request'''
+    indent = 4 if request.get('pretty') else None
+    mode = request.get('mode')
+    if mode == 'list' and request.get('hierarchical'):
+        output = query_hierarchical(hosts)
+        if request.get('nometa'):
+            del output['_meta']
+        return json.dumps(output, indent=indent, default=_jsonable)
+    elif mode == 'list':
+        output = io.StringIO()
+        write_list(hosts, output, request.get('pretty'), request.get('nometa'))
+        return output.getvalue()
+    elif mode == 'host':
+        return json.dumps(query_host(hosts, request['host']), indent=indent,
+                          default=_jsonable)
+    elif mode == 'hostfile':
+        return query_hostfile(hosts)
+
+    raise ValueError('unknown inventory request %r' % mode)
+
+
+# DAEMON
+def _filters(include, exclude):
+    '''the state file filters in a form that compares equal across runs'''
+    return [sorted(include or []), sorted(exclude or [])]
+
+
+def default_socket_path(cache_dir, roots, remotes=(), include=None, exclude=()):
+    import hashlib
+    # daemons with different filters serve different inventories
+    key = '\n'.join([_roots_key(roots)] + list(remotes) +
+                    [json.dumps(_filters(include, exclude))])
+    digest = hashlib.sha1(key.encode('utf-8'))
+    return os.path.join(cache_dir, digest.hexdigest() + '.sock')
+
+
+def query_daemon(socket_path, request, timeout=60):
+    '''return a running daemon's response to request, or None if there is
+    no daemon listening on socket_path or it could not answer'''
+    if not os.path.exists(socket_path):
+        return None
+
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    chunks = []
+    try:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        while True:
+            chunk = client.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except socket.error:
+        return None
+    finally:
+        client.close()
+
+    return b''.join(chunks).decode('utf-8') or None
+
+
+class InotifyWatcher(object):
+    '''report changes to `.tfstate` files below root using inotify(7)'''
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+            IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+    TREE_CHANGES = IN_ISDIR | IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF
+
+    timeout = None
+    _event = struct.Struct(str('iIII'))
+
+    def __init__(self, root, include=None, exclude=DEFAULT_EXCLUDES):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self.root = root
+        self.include = include or ['*.tfstate']
+        self.exclude = exclude
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(self._get_errno(), 'inotify_init failed')
+        self.watch()
+
+    def watch(self):
+        '''watch every directory below root, including new ones'''
+        import errno
+        for dirpath, _ in walk(self.root, self.exclude):
+            path = dirpath.encode(sys.getfilesystemencoding())
+            if self._libc.inotify_add_watch(self.fd, path, self.MASK) < 0:
+                error = self._get_errno()
+                if error == errno.ENOENT:
+                    # removed since the walk; its parent reports that
+                    continue
+                raise OSError(error, 'cannot watch %s with inotify' % dirpath)
+
+    def close(self):
+        os.close(self.fd)
+
+    def changed(self):
+        '''consume pending events and report whether any of them concerned a
+        state file or the directory tree'''
+        data = os.read(self.fd, 1 << 16)
+        offset = 0
+        changed = tree_changed = False
+        while offset < len(data):
+            _, mask, _, length = self._event.unpack_from(data, offset)
+            offset += self._event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & self.TREE_CHANGES:
+                changed = tree_changed = True
+            elif any(fnmatch.fnmatch(name.decode(sys.getfilesystemencoding()),
+                                     pattern) for pattern in self.include):
+                changed = True
+
+        if tree_changed:
+            self.watch()
+
+        return changed
+
+
+class PollingWatcher(object):
+    '''report changes to `.tfstate` files below root by comparing their
+    signatures every few seconds, for platforms without inotify'''
+    fd = None
+
+    def __init__(self, states, timeout=5):
+        self.states = states
+        self.timeout = timeout
+        self.checked = time.time()
+        self.signatures = self._signatures()
+
+    def _signatures(self):
+        signatures = {}
+        for filename in self.states():
+            try:
+                signatures[filename] = _state_signature(filename)
+            except OSError:
+                pass
+
+        return signatures
+
+    def changed(self):
+        if time.time() - self.checked < self.timeout:
+            return False
+
+        self.checked = time.time()
+        signatures = self._signatures()
+        changed, self.signatures = signatures != self.signatures, signatures
+        return changed
+
+
+class RemoteWatcher(object):
+    '''report changes to remote states, kept up to date by one thread per
+    source that waits on the server if it supports blocking queries and
+    polls every `interval` seconds otherwise'''
+    timeout = None
+
+    def __init__(self, sources, interval=5, wait='5m'):
+        import threading
+        self.fd, self._wakeup = os.pipe()
+        for source in sources:
+            thread = threading.Thread(target=self._watch,
+                                      args=(source, interval, wait))
+            thread.daemon = True
+            thread.start()
+
+    def _watch(self, source, interval, wait):
+        while True:
+            try:
+                if source.fetch(wait):
+                    os.write(self._wakeup, b'.')
+            except (IOError, OSError) as exc:
+                print('could not fetch %s: %s' % (source.url, exc),
+                      file=sys.stderr)
+            else:
+                if source.blocking:
+                    continue
+            time.sleep(interval)
+
+    def changed(self):
+        os.read(self.fd, 4096)
+        return True
+
+
+class InventoryServer(object):
+    '''keep the parsed inventory in memory and answer requests for it on a
+    unix socket until a state file below one of roots or a remote state
+    changes'''
+
+    def __init__(self, roots, socket_path, cache_dir=None, jobs=1,
+                 include=None, exclude=DEFAULT_EXCLUDES, remotes=()):
+        self.roots = roots
+        self.remotes = remotes
+        self.socket_path = socket_path
+        self.cache_dir = cache_dir
+        self.jobs = jobs
+        self.include = include
+        self.exclude = exclude
+        self.hosts = None
+        self.responses = {}
+
+    def states(self):
+        for filename in rootstates(self.roots, self.include, self.exclude,
+                                   self.cache_dir):
+            yield filename
+        for source in self.remotes:
+            yield source.path
+
+    def respond(self, request):
+        # a client given its own --socket may still filter differently;
+        # refusing makes it read the state itself
+        if request.get('filters', _filters(self.include, self.exclude)) != \
+                _filters(self.include, self.exclude):
+            raise ValueError('serving state files filtered by %r' %
+                             (_filters(self.include, self.exclude),))
+
+        if self.hosts is None:
+            # values only the previous hosts shared would pile up otherwise
+            _interned.clear()
+            self.hosts = list(loadhosts(self.states(), self.cache_dir,
+                                        self.jobs))
+            self.responses = {}
+
+        key = json.dumps(request, sort_keys=True)
+        try:
+            return self.responses[key]
+        except KeyError:
+            response = self.responses[key] = render(request, self.hosts)
+            return response
+
+    def _listen(self):
+        if query_daemon(self.socket_path, {'mode': 'hostfile'}) is not None:
+            raise SystemExit('an inventory daemon is already listening on %s' %
+                             self.socket_path)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        directory = os.path.dirname(self.socket_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        import socket
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen(16)
+        return listener
+
+    def _handle(self, conn):
+        conn.settimeout(5)
+        request = None
+        try:
+            request = json.loads(conn.makefile('rb').readline().decode('utf-8'))
+            conn.sendall(self.respond(request).encode('utf-8'))
+        except Exception as exc:  # keep serving; the client falls back
+            print('error answering %r: %s' % (request, exc), file=sys.stderr)
+        finally:
+            conn.close()
+
+    def _poll_instead(self, watchers, exc):
+        '''replace the inotify watchers with one that polls, after inotify
+        failed with exc'''
+        print('cannot watch state files with inotify, polling them instead: '
+              '%s' % exc, file=sys.stderr)
+        for watcher in watchers:
+            if isinstance(watcher, InotifyWatcher):
+                watcher.close()
+        return [PollingWatcher(self.states)] + [
+            watcher for watcher in watchers
+            if not isinstance(watcher, (InotifyWatcher, PollingWatcher))]
+
+    def serve_forever(self):
+        import select
+        import signal
+        try:
+            watchers = [InotifyWatcher(root, self.include, self.exclude)
+                        for root in self.roots]
+        except (AttributeError, OSError):
+            watchers = [PollingWatcher(self.states)]
+        if self.remotes:
+            for source in self.remotes:
+                refresh(source)
+            watchers.append(RemoteWatcher(self.remotes))
+
+        # clean up the socket when stopped by a service manager
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        listener = self._listen()
+        try:
+            while True:
+                timeouts = [w.timeout for w in watchers if w.timeout is not None]
+                fds = [listener] + [w.fd for w in watchers if w.fd is not None]
+                readable = select.select(fds, [], [],
+                                         min(timeouts) if timeouts else None)[0]
+                for watcher in watchers:
+                    if watcher.fd is not None and watcher.fd not in readable:
+                        continue
+                    try:
+                        changed = watcher.changed()
+                    except OSError as exc:
+                        # a watched directory went away or the system ran
+                        # out of inotify watches while adding new ones
+                        if not isinstance(watcher, InotifyWatcher):
+                            raise
+                        watchers = self._poll_instead(watchers, exc)
+                        self.hosts = None
+                        break
+                    if changed:
+                        self.hosts = None
+                if listener in readable:
+                    self._handle(listener.accept()[0])
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+
+
+def _env_list(name):
+    '''read a comma-separated list from the environment'''
+    return [item for item in os.environ.get(name, '').split(',') if item]
+
+
+def _env_flag(name):
+    '''read a boolean from the environment'''
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _profile_dest(value):
+    '''return where --profile (or TF_INVENTORY_PROFILE) reports: `-` for
+    stderr when it is just switched on, None when it is off, else the path
+    of the trace'''
+    if not value or value.lower() in ('0', 'false', 'no', 'off'):
+        return None
+    if value.lower() in ('-', '1', 'true', 'yes', 'on'):
+        return '-'
+    return value
+
+
+def main():
+    # answered before anything else is imported, for version checks that
+    # run the script often
+    if sys.argv[1:] == ['--version']:
+        print('%s %s' % (sys.argv[0], VERSION))
+        return
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        sys.argv[0], __doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter, )
+    modes = parser.add_mutually_exclusive_group(required=True)
+    modes.add_argument('--list',
+                       action='store_true',
+                       help='list all variables')
+    modes.add_argument('--host', help='list variables for a single host')
+    modes.add_argument('--version',
+                       action='store_true',
+                       help='print version and exit')
+    modes.add_argument('--hostfile',
+                       action='store_true',
+                       help='print hosts as a /etc/hosts snippet')
+    modes.add_argument('--changed-since', '--diff-since',
+                       metavar='SNAPSHOT',
+                       help='list the hosts added, removed or modified since '
+                            'the host hashes in SNAPSHOT were saved')
+    modes.add_argument('--snapshot',
+                       metavar='PATH',
+                       help='write the parsed hosts to a binary snapshot at '
+                            'PATH for --from-snapshot')
+    modes.add_argument('--serve',
+                       action='store_true',
+                       help='keep the inventory in memory and answer other '
+                            'invocations over a unix socket')
+    parser.add_argument('--pretty',
+                        action='store_true',
+                        help='pretty-print output JSON')
+    parser.add_argument('--nometa',
+                        action='store_true',
+                        help='with --list, exclude hostvars')
+    parser.add_argument('--hierarchical',
+                        action='store_true',
+                        default=_env_flag('TF_INVENTORY_HIERARCHICAL'),
+                        help='with --list, move variables shared by a dc= or '
+                             'role= group into group vars and nest groups '
+                             '(or set TF_INVENTORY_HIERARCHICAL)')
+    default_roots = os.environ.get('TERRAFORM_STATE_ROOT',
+                                   os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                                '..', '..', )))
+    default_roots = [root for root in default_roots.split(os.pathsep) if root]
+    parser.add_argument('--save-hashes',
+                        metavar='SNAPSHOT',
+                        help='save a content hash of every host to SNAPSHOT '
+                             'for a later --changed-since')
+    parser.add_argument('--root',
+                        action='append',
+                        help='custom root to search for `.tfstate`s in, may be '
+                             'repeated (default: %s, or set '
+                             'TERRAFORM_STATE_ROOT to a %r-separated list)' %
+                             (os.pathsep.join(default_roots), os.pathsep))
+    parser.add_argument('--remote',
+                        action='append',
+                        default=_env_list('TF_INVENTORY_REMOTE'),
+                        help='also read the state at this http(s):// or '
+                             'consul:// URL, may be repeated (or set '
+                             'TF_INVENTORY_REMOTE)')
+    parser.add_argument('--include',
+                        action='append',
+                        default=_env_list('TF_INVENTORY_INCLUDE'),
+                        help='glob for state file names, may be repeated '
+                             '(default: *.tfstate, or set TF_INVENTORY_INCLUDE)')
+    parser.add_argument('--exclude',
+                        action='append',
+                        default=_env_list('TF_INVENTORY_EXCLUDE'),
+                        help='glob for directories to skip in addition to %s, '
+                             'may be repeated (or set TF_INVENTORY_EXCLUDE)' %
+                             ', '.join(DEFAULT_EXCLUDES))
+    parser.add_argument('--from-snapshot',
+                        metavar='PATH',
+                        default=os.environ.get('TF_INVENTORY_SNAPSHOT'),
+                        help='answer from a snapshot written by --snapshot '
+                             'instead of reading state (or set '
+                             'TF_INVENTORY_SNAPSHOT)')
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const='-',
+                        metavar='TRACE',
+                        default=os.environ.get('TF_INVENTORY_PROFILE'),
+                        help='time discovery, loading, parsers and output and '
+                             'write a summary to stderr, or a Chrome trace '
+                             'to TRACE (or set TF_INVENTORY_PROFILE to 1 or '
+                             'TRACE)')
+    parser.add_argument('--cprofile',
+                        metavar='PATH',
+                        default=os.environ.get('TF_INVENTORY_CPROFILE'),
+                        help='also save cProfile stats to PATH (or set '
+                             'TF_INVENTORY_CPROFILE)')
+    parser.add_argument('--cache-dir',
+                        default=default_cache_dir(),
+                        help='directory for cached parse results '
+                             '(or set TF_INVENTORY_CACHE_DIR)')
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='always reparse every `.tfstate`')
+    parser.add_argument('--jobs',
+                        type=int,
+                        default=int(os.environ.get('TF_INVENTORY_JOBS', 1)),
+                        help='parse `.tfstate`s in this many processes, 0 for '
+                             'one per CPU (or set TF_INVENTORY_JOBS)')
+    parser.add_argument('--socket',
+                        default=os.environ.get('TF_INVENTORY_SOCKET'),
+                        help='unix socket of the inventory daemon (default: '
+                             'derived from --cache-dir, --root and --remote)')
+    parser.add_argument('--no-daemon',
+                        action='store_true',
+                        help='do not ask a running daemon')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print('%s %s' % (sys.argv[0], VERSION))
+        parser.exit()
+
+    import atexit
+    # a daemon would collect spans forever, so it is never profiled
+    profile = _profile_dest(args.profile)
+    if profile and not args.serve:
+        profiler.enabled = True
+        atexit.register(profiler.report, profile)
+    if args.cprofile and not args.serve:
+        import cProfile
+        python_profile = cProfile.Profile()
+        atexit.register(python_profile.dump_stats, args.cprofile)
+        atexit.register(python_profile.disable)
+        python_profile.enable()
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    if args.jobs:
+        jobs = args.jobs
+    else:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    exclude = DEFAULT_EXCLUDES + tuple(args.exclude)
+    roots = args.root or default_roots
+    socket_path = args.socket or default_socket_path(args.cache_dir, roots,
+                                                     args.remote, args.include,
+                                                     exclude)
+    try:
+        # remote states are downloaded even with --no-cache
+        remotes = [remote_state(url, args.cache_dir) for url in args.remote]
+    except ValueError as exc:
+        parser.error(exc)
+    if args.serve:
+        server = InventoryServer(roots, socket_path, cache_dir, jobs,
+                                 args.include, exclude, remotes)
+        server.serve_forever()
+
+    states = rootstates(roots, args.include, exclude, cache_dir)
+    if remotes:
+        states = chain(states, remote_states(remotes))
+
+    request = {'pretty': args.pretty,
+               'filters': _filters(args.include, exclude)}
+    if args.list:
+        request.update(mode='list', nometa=args.nometa)
+        if args.hierarchical:
+            request.update(hierarchical=True)
+    elif args.host:
+        request.update(mode='host', host=args.host)
+    elif args.hostfile:
+        request.update(mode='hostfile')
+
+    snapshot = None
+    if args.from_snapshot:
+        try:
+            snapshot = Snapshot(args.from_snapshot)
+        except (IOError, OSError, ValueError, struct.error) as exc:
+            parser.error('cannot read snapshot %s: %s' % (args.from_snapshot,
+                                                          exc))
+
+    output = None
+    if 'mode' in request and snapshot is None and not (args.no_daemon or
+                                                       args.save_hashes):
+        with profiler.span('query daemon') as details:
+            output = query_daemon(socket_path, request)
+            details['answered'] = output is not None
+
+    if output is not None:
+        print(output)
+    elif args.host and snapshot is not None and not args.save_hashes:
+        with profiler.span('output', mode='host', source='snapshot'):
+            found = snapshot.find(args.host)
+            output = found[1] if found is not None else {}
+            print(json.dumps(output, indent=4 if args.pretty else None,
+                             default=_jsonable))
+    elif args.host and cache_dir is not None and not args.save_hashes:
+        with profiler.span('output', mode='host', source='index'):
+            index = load_index(states, roots, cache_dir)
+            output = query_host_indexed(index, args.host)
+            print(json.dumps(output, indent=4 if args.pretty else None,
+                             default=_jsonable))
+    else:
+        if snapshot is not None:
+            hosts = snapshot
+        else:
+            hosts = loadhosts(states, cache_dir, jobs)
+        if args.save_hashes:
+            hosts = list(hosts)
+
+        # hosts are loaded while the output is written, so these spans
+        # include the loading spans
+        if args.snapshot:
+            with profiler.span('output', mode='snapshot'):
+                write_snapshot(args.snapshot, hosts)
+        elif args.changed_since:
+            with profiler.span('output', mode='changed-since'):
+                with open(args.changed_since, 'r') as json_file:
+                    previous = json.load(json_file)['hosts']
+                output = query_changed(hosts, previous)
+                print(json.dumps(output, indent=4 if args.pretty else None))
+        elif args.list and not args.hierarchical:
+            with profiler.span('output', mode='list'):
+                write_list(hosts, sys.stdout, args.pretty, args.nometa)
+                print()
+        else:
+            with profiler.span('output', mode=request.get('mode'),
+                               hierarchical=args.hierarchical):
+                print(render(request, hosts))
+
+        if args.save_hashes:
+            with open(args.save_hashes, 'w') as json_file:
+                json.dump({'hosts': host_hashes(hosts)}, json_file)
+
+    parser.exit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""
+Benchmark for plugins/inventory/terraform.py.
+
+Generates synthetic `.tfstate` files for every provider the inventory can
+parse, then times each stage of the inventory pipeline separately and reports
+throughput and peak memory:
+
+    python3 testing/inventory_benchmark.py --hosts 2000 --files 8
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'plugins', 'lib'))
+
+import terraform_inventory as tf  # noqa: E402
+
+ROLES = ['control', 'worker', 'edge', 'kubeworker']
+
+
+# SYNTHETIC RESOURCES
+# Each generator returns (primary id, flattened attributes) for host `i`.
+# `blob` is filler used for attributes that tend to be large in real state
+# (user data, keys, descriptions).
+
+def _ip(prefix, i):
+    return '%s.%d.%d' % (prefix, i // 250 % 250, i % 250 + 1)
+
+
+def _flat_list(attrs, prefix, values):
+    attrs[prefix + '.#'] = str(len(values))
+    for idx, value in enumerate(values):
+        attrs['%s.%d' % (prefix, idx)] = value
+
+
+def _flat_dict(attrs, prefix, values):
+    attrs[prefix + '.%'] = str(len(values))
+    for key, value in values.items():
+        attrs['%s.%s' % (prefix, key)] = value
+
+
+def _mantl_tags(i):
+    return {'role': ROLES[i % len(ROLES)], 'dc': 'dc%d' % (i % 3),
+            'ssh_user': 'centos'}
+
+
+def aws_instance(i, blob):
+    attrs = {
+        'ami': 'ami-%08x' % (i % 4), 'availability_zone': 'us-east-1a',
+        'ebs_optimized': 'false', 'ebs_block_device.#': '0',
+        'ephemeral_block_device.#': '0', 'id': 'i-%08x' % i,
+        'key_name': 'mantl-key', 'private_dns': 'ip-%d.ec2.internal' % i,
+        'private_ip': _ip('10.0', i), 'public_dns': 'ec2-%d.amazonaws.com' % i,
+        'public_ip': _ip('54.0', i), 'root_block_device.#': '1',
+        'root_block_device.0.volume_size': '20',
+        'root_block_device.0.volume_type': 'gp2', 'security_groups.#': '0',
+        'tenancy': 'default', 'user_data': blob,
+    }
+    tags = _mantl_tags(i)
+    tags.update(Name='mantl-%s-%05d' % (tags['role'], i), sshUser='centos')
+    _flat_dict(attrs, 'tags', tags)
+    _flat_list(attrs, 'vpc_security_group_ids', ['sg-1', 'sg-2'])
+    return attrs['id'], attrs
+
+
+def google_compute_instance(i, blob):
+    attrs = {
+        'can_ip_forward': 'false', 'disk.#': '1', 'disk.0.image': 'centos-7',
+        'machine_type': 'n1-standard-2', 'network.#': '0',
+        'network_interface.#': '1',
+        'network_interface.0.address': _ip('10.1', i),
+        'network_interface.0.access_config.#': '1',
+        'network_interface.0.access_config.0.nat_ip': _ip('35.0', i),
+        'network_interface.0.access_config.0.assigned_nat_ip': '',
+        'self_link': 'https://www.googleapis.com/compute/v1/instances/%d' % i,
+        'service_account.#': '0', 'zone': 'us-central1-a',
+    }
+    metadata = _mantl_tags(i)
+    metadata['sshKeys'] = blob
+    _flat_dict(attrs, 'metadata', metadata)
+    _flat_list(attrs, 'tags', ['mantl', metadata['role']])
+    return 'mantl-gce-%05d' % i, attrs
+
+
+def openstack_compute_instance_v2(i, blob):
+    attrs = {
+        'access_ip_v4': _ip('10.2', i), 'access_ip_v6': '', 'flavor_id': '3',
+        'flavor_name': 'm1.medium', 'id': 'os-%d' % i, 'image_id': 'abc',
+        'image_name': 'centos-7', 'key_pair': 'mantl', 'name': 'mantl-os-%05d' % i,
+        'network.#': '1', 'network.0.fixed_ip_v4': _ip('10.2', i),
+        'network.0.name': 'mantl', 'region': 'RegionOne', 'user_data': blob,
+    }
+    _flat_dict(attrs, 'metadata', _mantl_tags(i))
+    _flat_list(attrs, 'security_groups', ['default'])
+    return attrs['id'], attrs
+
+
+def vsphere_virtual_machine(i, blob):
+    attrs = {
+        'id': 'vm-%d' % i, 'name': 'mantl-vsphere-%05d' % i,
+        'network_interface.#': '1',
+        'network_interface.0.ip_address': _ip('10.3', i),
+        'network_interface.0.ipv4_address': _ip('10.3', i),
+        'network_interface.0.label': 'VM Network',
+    }
+    params = _mantl_tags(i)
+    params['consul_dc'] = params.pop('dc')
+    params['notes'] = blob
+    _flat_dict(attrs, 'custom_configuration_parameters', params)
+    return attrs['id'], attrs
+
+
+def azure_instance(i, blob):
+    attrs = {
+        'automatic_updates': 'false', 'description': ROLES[i % len(ROLES)],
+        'hosted_service_name': 'mantl', 'id': 'az-%d' % i,
+        'image': 'OpenLogic 7.1', 'ip_address': _ip('10.4', i),
+        'location': 'West US', 'name': 'mantl-az-%05d' % i, 'reverse_dns': '',
+        'security_group': 'mantl', 'size': 'Standard_D2',
+        'ssh_key_thumbprint': blob, 'subnett': 'mantl', 'username': 'centos',
+        'vip_address': _ip('40.0', i), 'virtual_network': 'mantl',
+        'endpoint.#': '1', 'endpoint.0.name': 'ssh',
+        'endpoint.0.public_port': '22',
+    }
+    return attrs['id'], attrs
+
+
+def clc_server(i, blob):
+    attrs = {
+        'id': 'mantl-clc-%05d' % i, 'private_ip_address': _ip('10.5', i),
+        'public_ip_address': _ip('64.0', i), 'description': blob,
+    }
+    _flat_dict(attrs, 'metadata', _mantl_tags(i))
+    return attrs['id'], attrs
+
+
+def ucs_service_profile(i, blob):
+    attrs = {'vNIC.#': '1', 'vNIC.0.ip': _ip('10.6', i), 'description': blob}
+    _flat_dict(attrs, 'metadata', _mantl_tags(i))
+    return 'mantl-ucs-%05d' % i, attrs
+
+
+def triton_machine(i, blob):
+    attrs = {
+        'id': 'triton-%d' % i, 'dataset': 'centos-7', 'disk': '25600',
+        'firewall_enabled': 'false', 'image': 'img-1', 'memory': '4096',
+        'name': 'mantl-triton-%05d' % i, 'package': 'g4-highcpu-4G',
+        'primaryip': _ip('165.0', i), 'root_authorized_keys': blob,
+        'state': 'running', 'type': 'smartmachine', 'user_data': '',
+        'user_script': '',
+    }
+    _flat_list(attrs, 'ips', [_ip('165.0', i), _ip('10.7', i)])
+    _flat_list(attrs, 'networks', ['public', 'private'])
+    _flat_dict(attrs, 'tags', _mantl_tags(i))
+    return attrs['id'], attrs
+
+
+def digitalocean_droplet(i, blob):
+    metadata = _mantl_tags(i)
+    metadata['notes'] = blob
+    attrs = {
+        'id': str(i), 'image': 'centos-7-x64', 'ipv4_address': _ip('104.0', i),
+        'ipv4_address_private': _ip('10.8', i), 'locked': 'false',
+        'name': 'mantl-do-%05d' % i, 'region': 'nyc3', 'size': '4gb',
+        'status': 'active', 'user_data': json.dumps(metadata),
+    }
+    _flat_list(attrs, 'ssh_keys', ['12345'])
+    return attrs['id'], attrs
+
+
+def softlayer_virtualserver(i, blob):
+    metadata = _mantl_tags(i)
+    metadata['notes'] = blob
+    attrs = {
+        'id': str(i), 'image': 'CENTOS_7_64', 'ipv4_address': _ip('169.0', i),
+        'ipv4_address_private': _ip('10.9', i), 'name': 'mantl-sl-%05d' % i,
+        'region': 'ams01', 'ram': '4096', 'cpu': '2',
+        'user_data': json.dumps(metadata),
+    }
+    _flat_list(attrs, 'ssh_keys', ['12345'])
+    return attrs['id'], attrs
+
+
+def aws_security_group(i, blob):
+    attrs = {'id': 'sg-%08x' % i, 'name': 'mantl-%d' % i, 'description': blob}
+    return attrs['id'], attrs
+
+
+GENERATORS = dict((gen.__name__, gen) for gen in [
+    aws_instance, google_compute_instance, openstack_compute_instance_v2,
+    vsphere_virtual_machine, azure_instance, clc_server, ucs_service_profile,
+    triton_machine, digitalocean_droplet, softlayer_virtualserver,
+])
+
+
+def _unflatten(attrs):
+    '''turn flatmap attributes into the native values of a 0.12+ state'''
+    nested = {}
+    for compkey in sorted(attrs):
+        parts = compkey.split('.')
+        if parts[-1] in ('#', '%'):
+            continue
+        node = nested
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = attrs[compkey]
+
+    def lists(value):
+        if not isinstance(value, dict):
+            return value
+        value = dict((key, lists(item)) for key, item in value.items())
+        if value and all(key.isdigit() for key in value):
+            return [value[key] for key in sorted(value, key=int)]
+        return value
+
+    return lists(nested)
+
+
+def generate(root, hosts, files, providers, blob_size, noise, state_format,
+             seed=0):
+    '''write `files` state files below root with `hosts` hosts in total,
+    spread round-robin over providers, plus `noise` non-host resources per
+    host; return the list of written paths'''
+    rng = random.Random(seed)
+    per_file = [hosts // files + (1 if idx < hosts % files else 0)
+                for idx in range(files)]
+    paths = []
+    host = 0
+    for idx, count in enumerate(per_file):
+        resources = []
+        for _ in range(count):
+            blob = ''.join(rng.choice('abcdefghijklmnop0123456789+/')
+                           for _ in range(blob_size))
+            kind = providers[host % len(providers)]
+            resources.append((kind, 'host%d' % host,
+                              GENERATORS[kind](host, blob)))
+            for extra in range(noise):
+                resources.append(('aws_security_group',
+                                  'sg%d_%d' % (host, extra),
+                                  aws_security_group(host, blob)))
+            host += 1
+
+        if state_format == 4:
+            state = {
+                'version': 4, 'terraform_version': '0.12.31', 'serial': 1,
+                'lineage': 'benchmark', 'outputs': {},
+                'resources': [{
+                    'mode': 'managed', 'type': kind, 'name': name,
+                    'provider': 'provider.%s' % kind.split('_')[0],
+                    'instances': [{
+                        'schema_version': 0,
+                        'attributes': dict(_unflatten(attrs), id=primary_id),
+                    }],
+                } for kind, name, (primary_id, attrs) in resources],
+            }
+        else:
+            state = {
+                'version': 3, 'terraform_version': '0.11.14', 'serial': 1,
+                'modules': [{
+                    'path': ['root'], 'outputs': {}, 'depends_on': [],
+                    'resources': dict(('%s.%s' % (kind, name), {
+                        'type': kind,
+                        'primary': {'id': primary_id, 'attributes': attrs},
+                    }) for kind, name, (primary_id, attrs) in resources),
+                }],
+            }
+
+        directory = os.path.join(root, 'env%03d' % idx)
+        os.makedirs(directory)
+        path = os.path.join(directory, 'terraform.tfstate')
+        with io.open(path, 'w', encoding='utf-8') as state_file:
+            state_file.write(json.dumps(state, indent=2, sort_keys=True))
+        paths.append(path)
+
+    return paths
+
+
+# STAGES
+def _stages(root):
+    '''yield (stage name, setup, run) for each pipeline stage; setup builds
+    the stage's input outside of the timed region'''
+    files = lambda: list(tf.tfstates(root))  # noqa: E731
+    resources = lambda: list(tf.iterresources(files()))  # noqa: E731
+    hosts = lambda: list(tf.iterhosts(resources()))  # noqa: E731
+
+    yield 'tfstates', lambda: root, lambda root: list(tf.tfstates(root))
+    yield 'iterresources', files, lambda files: list(tf.iterresources(files))
+    yield 'iterhosts', resources, lambda resources: list(tf.iterhosts(resources))
+    yield 'query_list', hosts, tf.query_list
+    yield 'query_hostfile', hosts, tf.query_hostfile
+    yield 'write_list', hosts, lambda hosts: tf.write_list(hosts, io.StringIO())
+
+
+def measure(root, repeat):
+    '''return one result dict per stage with the best time of `repeat` runs
+    and the peak memory allocated while running it once'''
+    results = []
+    for name, setup, run in _stages(root):
+        best = None
+        for _ in range(repeat):
+            data = setup()
+            start = time.time()
+            run(data)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        data = setup()
+        tracemalloc.start()
+        run(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append({'stage': name, 'seconds': best, 'peak_bytes': peak})
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        __file__, __doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter, )
+    parser.add_argument('--hosts', type=int, default=1000,
+                        help='number of hosts to generate')
+    parser.add_argument('--files', type=int, default=4,
+                        help='number of state files to spread hosts over')
+    parser.add_argument('--providers', default=','.join(sorted(GENERATORS)),
+                        help='comma-separated resource types to generate')
+    parser.add_argument('--attr-size', type=int, default=256,
+                        help='size of the large attribute on every resource')
+    parser.add_argument('--noise', type=int, default=2,
+                        help='non-host resources generated per host')
+    parser.add_argument('--state-format', type=int, choices=[3, 4], default=3,
+                        help='legacy (3) or Terraform 0.12+ (4) state')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='time each stage this many times, keep the best')
+    parser.add_argument('--keep',
+                        help='generate into this directory and keep it')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    providers = args.providers.split(',')
+    unknown = set(providers) - set(GENERATORS)
+    if unknown:
+        parser.error('no generator for %s' % ', '.join(sorted(unknown)))
+
+    root = args.keep or tempfile.mkdtemp(prefix='tfinventory-bench-')
+    try:
+        paths = generate(root, args.hosts, args.files, providers,
+                         args.attr_size, args.noise, args.state_format)
+        size = sum(os.path.getsize(path) for path in paths)
+        results = measure(root, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root)
+
+    for result in results:
+        result['hosts_per_second'] = args.hosts / max(result['seconds'], 1e-9)
+
+    if args.json:
+        print(json.dumps({'hosts': args.hosts, 'files': args.files,
+                          'state_bytes': size, 'stages': results}, indent=4))
+        return
+
+    print('%d hosts in %d files (%.1f MB of state)' %
+          (args.hosts, args.files, size / 1e6))
+    print('%-16s %10s %14s %12s' % ('stage', 'seconds', 'hosts/second',
+                                    'peak MB'))
+    for result in results:
+        print('%-16s %10.4f %14.0f %12.2f' % (
+            result['stage'], result['seconds'], result['hosts_per_second'],
+            result['peak_bytes'] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the remote state backends read by
+plugins/inventory/terraform.py --remote.
+
+Serves the files below a directory both as a plain HTTP backend (with ETags
+and If-None-Match) and as a minimal Consul KV API (`?raw`, `?keys` and
+blocking queries on X-Consul-Index), and logs every request with its status
+so conditional fetches can be checked:
+
+    python testing/tfstate_server.py states/ --port 8500 &
+    plugins/inventory/terraform.py --list --no-daemon \\
+        --remote http://localhost:8500/prod/terraform.tfstate \\
+        --remote consul://localhost:8500/prod/terraform.tfstate
+
+Like Consul, `?keys` answers with the highest index under the prefix, but a
+single key read with the index of the whole store, which any other file
+below the directory moves.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlsplit
+except ImportError:  # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlsplit
+
+
+def _index(path):
+    '''a Consul-like modify index for path, which grows with its mtime'''
+    try:
+        return int(os.stat(path).st_mtime * 1000)
+    except OSError:
+        return 0
+
+
+def _table_index(root):
+    '''the index of the whole KV store, which moves with any of its keys'''
+    return max([_index(os.path.join(dirpath, name))
+                for dirpath, _, names in os.walk(root) for name in names] +
+               [_index(root)])
+
+
+def _duration(value):
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    for suffix in sorted(units, key=len, reverse=True):
+        if value.endswith(suffix):
+            return float(value[:-len(suffix)]) * units[suffix]
+    return float(value)
+
+
+class StateHandler(BaseHTTPRequestHandler):
+    root = '.'
+
+    def _path(self, relpath):
+        path = os.path.normpath(os.path.join(self.root, unquote(relpath)))
+        if not path.startswith(self.root):
+            return None
+        return path
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in sorted((headers or {}).items()):
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path.startswith('/v1/kv/'):
+            self._consul(parts.path[len('/v1/kv/'):], parse_qs(parts.query, True))
+        else:
+            self._http(parts.path.lstrip('/'))
+
+    def _http(self, relpath):
+        path = self._path(relpath)
+        if path is None or not os.path.isfile(path):
+            return self._send(404)
+
+        with open(path, 'rb') as state_file:
+            body = state_file.read()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, headers={'ETag': etag})
+        self._send(200, body, {'ETag': etag,
+                               'Content-Type': 'application/json'})
+
+    def _consul(self, key, query):
+        prefix = self._path(key)
+        if prefix is None:
+            return self._send(404)
+
+        # keys under the prefix, as the KV store would match them
+        directory = os.path.dirname(prefix)
+        matches = []
+        if os.path.isdir(directory):
+            matches = [os.path.join(directory, name)
+                       for name in sorted(os.listdir(directory))
+                       if os.path.join(directory, name).startswith(prefix)]
+
+        def index():
+            if 'keys' not in query:
+                return _table_index(self.root)
+            return max([_index(path) for path in matches] or [_index(directory)])
+
+        if 'index' in query:
+            deadline = time.time() + _duration(query.get('wait', ['5m'])[0])
+            while index() <= int(query['index'][0]) and time.time() < deadline:
+                time.sleep(0.05)
+
+        headers = {'X-Consul-Index': str(index())}
+        if 'keys' in query:
+            keys = [os.path.relpath(path, self.root) for path in matches]
+            if not keys:
+                return self._send(404, headers=headers)
+            return self._send(200, json.dumps(keys).encode('utf-8'), headers)
+
+        if not os.path.isfile(prefix):
+            return self._send(404, headers=headers)
+        with open(prefix, 'rb') as state_file:
+            body = state_file.read()
+        if 'raw' not in query:
+            return self._send(501, b'only ?raw and ?keys are supported',
+                              headers)
+        self._send(200, body, headers)
+
+    def log_message(self, format, *args):
+        print('%s %s' % (time.strftime('%H:%M:%S'), format % args),
+              file=sys.stderr)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='directory with the states to serve')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    args = parser.parse_args()
+
+    StateHandler.root = os.path.abspath(args.root)
+    server = ThreadingServer((args.host, args.port), StateHandler)
+    print('serving %s on http://%s:%d' % (StateHandler.root, args.host, args.port),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
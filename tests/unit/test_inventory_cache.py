@@ -0,0 +1,52 @@
+"""
+Hosts loaded back from the parse cache or a snapshot of
+plugins/lib/terraform_inventory.py: they must equal the hosts that were
+stored, and share one copy of each group name like freshly parsed ones.
+"""
+from __future__ import unicode_literals
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'plugins', 'lib'))
+
+import terraform_inventory as tf  # noqa: E402
+
+HOSTS = [
+    ('host-%02d' % number,
+     tf.HostVars({'ansible_ssh_host': '10.0.0.%d' % number, 'role': 'worker',
+                  'consul_dc': 'east', 'tags': {'env': 'prod'}}),
+     ['dc=east', 'role=worker', 'aws_tag_env=prod'])
+    for number in range(4)
+]
+
+
+def _check(hosts):
+    assert [(name, attrs.as_dict(), groups) for name, attrs, groups in hosts] == \
+        [(name, attrs.as_dict(), groups) for name, attrs, groups in HOSTS]
+    for position in range(3):
+        assert len(set(id(groups[position]) for _, _, groups in hosts)) == 1
+
+
+def test_read_cache(tmpdir):
+    cache_dir = str(tmpdir)
+    signature = ['v', 1]
+    tf.write_cache(cache_dir, 'prod.tfstate', signature, HOSTS)
+
+    _check(tf.read_cache(cache_dir, 'prod.tfstate', signature))
+    assert tf.read_cache(cache_dir, 'prod.tfstate', ['v', 2]) is None
+
+
+def test_snapshot(tmpdir):
+    path = str(tmpdir.join('inventory.snapshot'))
+    tf.write_snapshot(path, HOSTS)
+
+    snapshot = tf.Snapshot(path)
+    try:
+        assert len(snapshot) == len(HOSTS)
+        _check(list(snapshot))
+        _check([snapshot.find(name) for name, _, _ in HOSTS])
+        assert snapshot.find('missing') is None
+    finally:
+        snapshot.close()
@@ -0,0 +1,160 @@
+"""
+The --list output of plugins/lib/terraform_inventory.py. write_list streams
+the JSON by hand instead of building the whole inventory for json.dumps,
+so it is compared with json.dumps of query_list text for text.
+"""
+from __future__ import unicode_literals
+
+import json
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'plugins', 'lib'))
+
+import terraform_inventory as tf  # noqa: E402
+
+
+def _host(name, dc, role, **extra):
+    attrs = tf.HostVars({'ansible_ssh_host': '10.0.0.%d' % (len(name) % 250),
+                         'ansible_ssh_user': 'centos', 'consul_dc': dc,
+                         'provider': 'aws', 'role': role, 'id': 'i-' + name})
+    attrs.update(extra)
+    groups = ['dc=' + dc, 'role=' + role, 'aws_tag_env=prod', 'dc=' + dc]
+    return name, attrs, groups
+
+
+HOSTS = [
+    _host('control-01', 'east', 'control', consul_is_server=True),
+    _host('control-02', 'east', 'control', consul_is_server=True),
+    _host('worker-01', 'east', 'worker', tags={'a': ['b', {'c': None}]},
+          public_ipv4='1.2.3.4'),
+    _host('worker-02', 'west', 'worker', ansible_python_interpreter='python3'),
+    _host('edge-é中', 'west', 'edge', note='quote " backslash \\ newline \n'),
+    # a host in no group at all
+    ('lonely', tf.HostVars({'ansible_ssh_host': '10.0.0.9'}), []),
+]
+
+
+def _expected(hosts, pretty, nometa):
+    groups = tf.query_list(hosts)
+    meta = groups.pop('_meta')
+    output = OrderedDict() if nometa else OrderedDict([('_meta', meta)])
+    output.update(groups)
+    return json.dumps(output, indent=4 if pretty else None,
+                      default=tf._jsonable)
+
+
+@pytest.mark.parametrize('hosts', [HOSTS, HOSTS[:1], HOSTS[-1:], []],
+                         ids=['hosts', 'one', 'ungrouped', 'empty'])
+@pytest.mark.parametrize('pretty', [False, True])
+@pytest.mark.parametrize('nometa', [False, True])
+def test_write_list(hosts, pretty, nometa):
+    out = tf.io.StringIO()
+    tf.write_list(iter(hosts), out, pretty, nometa)
+    assert out.getvalue() == _expected(hosts, pretty, nometa)
+
+
+def _resolve(inventory):
+    '''return the variables and groups of each host as Ansible would see
+    them, following children up to every ancestor group'''
+    parents = {}
+    for group, entry in inventory.items():
+        for child in entry.get('children', []):
+            parents.setdefault(child, set()).add(group)
+
+    def ancestors(group):
+        found = set([group])
+        for parent in parents.get(group, ()):
+            found |= ancestors(parent)
+        return found
+
+    membership = {}
+    for group, entry in inventory.items():
+        for name in entry.get('hosts', []):
+            membership.setdefault(name, set()).update(ancestors(group))
+
+    resolved = {}
+    for name, hostvars in inventory['_meta']['hostvars'].items():
+        groups = membership.get(name, set())
+        merged = {}
+        for group in groups:
+            for key, value in inventory[group].get('vars', {}).items():
+                # a variable must come from one group only, so Ansible's
+                # group precedence never decides between values
+                assert key not in merged, (name, key)
+                merged[key] = value
+        for key in hostvars:
+            assert key not in merged, (name, key)
+        merged.update(hostvars)
+        resolved[name] = (merged, groups)
+    return resolved
+
+
+def _mixed_hosts():
+    hosts = list(HOSTS)
+    # the same dc and role with another user, and one without a role
+    hosts.append(_host('control-03', 'east', 'control', consul_is_server=True,
+                       ansible_ssh_user='root'))
+    name, attrs, groups = _host('worker-03', 'west', 'worker')
+    del attrs['role']
+    hosts.append((name, attrs, groups))
+    # in two dcs, so in no dc=_role= group
+    name, attrs, groups = _host('bridge', 'east', 'worker')
+    hosts.append((name, attrs, groups + ['dc=west']))
+    return hosts
+
+
+def _random_hosts(seed):
+    import random
+    rng = random.Random(seed)
+    hosts = []
+    for number in range(rng.randint(0, 30)):
+        extra = dict((key, rng.choice(['a', 'b', True, False]))
+                     for key in tf.FACTORED_VARS if rng.random() < 0.3)
+        name, attrs, groups = _host('host-%d' % number, rng.choice('xyz'),
+                                    rng.choice(['control', 'worker']))
+        attrs.update(extra)
+        for key in tf.FACTORED_VARS:
+            if rng.random() < 0.1 and key in attrs:
+                del attrs[key]
+        if rng.random() < 0.1:
+            groups = [group for group in groups if not group.startswith('role=')]
+        if rng.random() < 0.1:
+            groups.append(rng.choice(['dc=', 'role=']) + rng.choice('xyz'))
+        hosts.append((name, attrs, groups))
+    return hosts
+
+
+@pytest.mark.parametrize('hosts', [HOSTS, _mixed_hosts(), []] +
+                         [_random_hosts(seed) for seed in range(40)])
+def test_hierarchical_hostvars(hosts):
+    flat = tf.query_list(hosts)
+    expected = dict((name, (dict(attrs), set(group for group, entry in flat.items()
+                                             if name in entry.get('hosts', ()))))
+                    for name, attrs in flat['_meta']['hostvars'].items())
+
+    hierarchical = json.loads(json.dumps(tf.query_hierarchical(hosts),
+                                         default=tf._jsonable))
+    resolved = _resolve(hierarchical)
+
+    for name, (variables, groups) in resolved.items():
+        expected_vars, expected_groups = expected[name]
+        assert variables == json.loads(json.dumps(expected_vars, default=tf._jsonable))
+        # the dc=_role= groups are the only ones added
+        assert set(group for group in groups if '_role=' not in group) == expected_groups
+    assert set(resolved) == set(expected)
+
+
+def test_hierarchical_factors_shared_vars():
+    inventory = tf.query_hierarchical(_mixed_hosts())
+    hostvars = inventory['_meta']['hostvars']
+    # east control hosts disagree on the user, so it stays with each host
+    assert 'ansible_ssh_user' not in inventory['dc=east_role=control'].get('vars', {})
+    assert hostvars['control-03']['ansible_ssh_user'] == 'root'
+    assert 'provider' not in hostvars['worker-01']
+    assert 'dc=east_role=control' in inventory['dc=east']['children']
+    assert 'dc=east_role=control' in inventory['role=control']['children']
@@ -0,0 +1,551 @@
+"""
+library/kube.py: the label selectors and live/definition comparison the
+module evaluates itself instead of asking kubectl or the API server, how
+the output of kubectl is turned into results, the API client, and when
+an object counts as ready while waiting for it.
+"""
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+try:
+    import socketserver
+except ImportError:  # python 2
+    import SocketServer as socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'library'))
+
+pytest.importorskip('ansible.module_utils.basic')
+
+import kube  # noqa: E402
+
+LABELS = {'app': 'nginx', 'tier': 'frontend', 'example.com/track': 'stable'}
+
+
+@pytest.mark.parametrize('selector, requirements', [
+    ('app=nginx', [('app', 'in', set(['nginx']))]),
+    ('app==nginx', [('app', 'in', set(['nginx']))]),
+    ('app = nginx', [('app', 'in', set(['nginx']))]),
+    ('app!=nginx', [('app', '!=', set(['nginx']))]),
+    ('app=', [('app', 'in', set(['']))]),
+    ('app in (nginx, web)', [('app', 'in', set(['nginx', 'web']))]),
+    ('app notin (nginx,web)', [('app', 'notin', set(['nginx', 'web']))]),
+    ('app', [('app', 'exists', None)]),
+    ('!app', [('app', '!', None)]),
+    ('example.com/track=stable', [('example.com/track', 'in', set(['stable']))]),
+    ('app in (nginx, web),tier!=backend, !canary',
+     [('app', 'in', set(['nginx', 'web'])), ('tier', '!=', set(['backend'])),
+      ('canary', '!', None)]),
+])
+def test_parse_selector(selector, requirements):
+    assert kube.parse_selector(selector) == requirements
+
+
+@pytest.mark.parametrize('selector', [
+    '',
+    ',',
+    'app=nginx,',
+    'app=nginx,,tier=frontend',
+    'app in (nginx',
+    'app in nginx',
+    'app notin ((nginx))',
+    'app in (ngi nx)',
+    'app=ngi nx',
+    'app=nginx=web',
+    'app=(nginx)',
+    '!',
+    '!!app',
+    '=nginx',
+    'app nginx',
+])
+def test_parse_selector_malformed(selector):
+    with pytest.raises(ValueError):
+        kube.parse_selector(selector)
+
+
+@pytest.mark.parametrize('selector, matches', [
+    ('app=nginx', True),
+    ('app==nginx', True),
+    ('app=web', False),
+    ('app!=web', True),
+    ('app!=nginx', False),
+    ('canary!=yes', True),
+    ('app in (web, nginx)', True),
+    ('app in (web, api)', False),
+    ('canary in (yes)', False),
+    ('app notin (web, api)', True),
+    ('app notin (nginx)', False),
+    ('canary notin (yes)', True),
+    ('tier', True),
+    ('canary', False),
+    ('!canary', True),
+    ('!tier', False),
+    ('example.com/track=stable', True),
+    ('app=nginx,tier=frontend', True),
+    ('app=nginx,tier=backend', False),
+    ('app in (nginx, web), !canary, tier', True),
+])
+def test_selector_matches(selector, matches):
+    assert kube.selector_matches(kube.parse_selector(selector), LABELS) is matches
+
+
+LIVE = {
+    'apiVersion': 'v1',
+    'kind': 'Service',
+    'metadata': {'name': 'nginx', 'namespace': 'default', 'uid': 'abc',
+                 'labels': {'app': 'nginx'}},
+    'spec': {'ports': [{'port': 80, 'targetPort': 8080, 'protocol': 'TCP'}],
+             'selector': {'app': 'nginx'}, 'clusterIP': '10.0.0.1'},
+    'status': {'loadBalancer': {}},
+}
+
+
+@pytest.mark.parametrize('desired, contained', [
+    # defaults and status the server filled in are ignored
+    ({'kind': 'Service', 'metadata': {'name': 'nginx'}}, True),
+    ({'spec': {'ports': [{'port': 80}], 'selector': {'app': 'nginx'}}}, True),
+    # int-or-string fields come back in either form
+    ({'spec': {'ports': [{'port': '80', 'targetPort': '8080'}]}}, True),
+    # empty values the server leaves out
+    ({'metadata': {'annotations': {}}, 'spec': {'externalIPs': []}}, True),
+    ({'spec': {'sessionAffinity': None}}, True),
+    ({'metadata': {'labels': {'app': 'web'}}}, False),
+    ({'metadata': {'labels': {'tier': 'frontend'}}}, False),
+    ({'spec': {'ports': [{'port': 443}]}}, False),
+    ({'spec': {'ports': [{'port': 80}, {'port': 443}]}}, False),
+    ({'spec': {'ports': []}}, False),
+    ({'spec': {'selector': 'app=nginx'}}, False),
+    ({'spec': {'clusterIP': ['10.0.0.1']}}, False),
+])
+def test_contains(desired, contained):
+    assert kube.contains(LIVE, desired) is contained
+
+
+def _obj(status=None, spec=None, generation=None):
+    obj = {'metadata': {'name': 'x'}}
+    if generation is not None:
+        obj['metadata']['generation'] = generation
+    if status is not None:
+        obj['status'] = status
+    if spec is not None:
+        obj['spec'] = spec
+    return obj
+
+
+def _conditions(**conditions):
+    return {'conditions': [{'type': kind, 'status': status}
+                           for kind, status in sorted(conditions.items())]}
+
+
+@pytest.mark.parametrize('kind, obj, is_ready', [
+    ('Pod', _obj(_conditions(Ready='True')), True),
+    ('Pod', _obj(_conditions(Ready='False', PodScheduled='True')), False),
+    ('Pod', _obj({'phase': 'Pending'}), False),
+    ('Job', _obj(_conditions(Complete='True')), True),
+    ('Job', _obj(_conditions(Failed='True')), False),
+    ('Job', _obj({'active': 1}), False),
+    ('DaemonSet', _obj({'desiredNumberScheduled': 3, 'numberReady': 3,
+                        'updatedNumberScheduled': 3}), True),
+    ('DaemonSet', _obj({'desiredNumberScheduled': 3, 'numberReady': 2,
+                        'updatedNumberScheduled': 3}), False),
+    # ready, but still running the previous template
+    ('DaemonSet', _obj({'desiredNumberScheduled': 3, 'numberReady': 3,
+                        'updatedNumberScheduled': 1}), False),
+    ('DaemonSet', _obj({}), True),
+    ('Deployment', _obj({'readyReplicas': 3, 'updatedReplicas': 3}, {'replicas': 3}), True),
+    # the old replicas are ready, the new ones not yet
+    ('Deployment', _obj({'readyReplicas': 3, 'updatedReplicas': 1}, {'replicas': 3}), False),
+    ('Deployment', _obj({'readyReplicas': 2, 'updatedReplicas': 3}, {'replicas': 3}), False),
+    ('Deployment', _obj({}, {}), False),
+    ('Deployment', _obj({'updatedReplicas': 0}, {'replicas': 0}), True),
+    ('StatefulSet', _obj({'readyReplicas': 2}, {'replicas': 2}), True),
+    ('ReplicationController', _obj({'readyReplicas': 1}, {'replicas': 2}), False),
+    # any kind with replicas follows the same rule
+    ('Widget', _obj({'readyReplicas': 2}, {'replicas': 2}), True),
+    ('Widget', _obj(_conditions(Ready='False')), False),
+    ('Widget', _obj(_conditions(Available='True')), True),
+    ('Service', _obj({'loadBalancer': {}}, {'ports': []}), True),
+    ('ConfigMap', {'metadata': {'name': 'x'}, 'data': {}}, True),
+    # the status describes an older generation of the spec
+    ('Deployment', _obj({'observedGeneration': 1, 'readyReplicas': 1, 'updatedReplicas': 1},
+                        {'replicas': 1}, generation=2), False),
+    ('Deployment', _obj({'observedGeneration': 2, 'readyReplicas': 1, 'updatedReplicas': 1},
+                        {'replicas': 1}, generation=2), True),
+    ('Pod', _obj(dict(_conditions(Ready='True'), observedGeneration=1), generation=2), False),
+    ('Widget', _obj({}, generation=3), True),
+])
+def test_ready(kind, obj, is_ready):
+    assert kube.ready(obj, kind) is is_ready
+
+
+class ApiHandler(socketserver.StreamRequestHandler):
+    """Answers requests with {} unless the server's next action says to
+    close the connection after answering, hang, or close without answering."""
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line.strip():
+                return
+            length = 0
+            for header in iter(self.rfile.readline, b'\r\n'):
+                name, _, value = header.decode('ascii').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            self.rfile.read(length)
+            self.server.requests.append(line.decode('ascii').split()[0])
+
+            action = self.server.actions.pop(0) if self.server.actions else 'answer'
+            if action == 'hang':
+                self.server.release.wait(5)
+                return
+            if action == 'drop':
+                return
+            self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: 2\r\n\r\n{}')
+            self.wfile.flush()
+            if action == 'close':
+                return
+
+
+@pytest.fixture
+def api():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), ApiHandler)
+    server.daemon_threads = True
+    server.requests, server.actions = [], []
+    server.release = threading.Event()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = kube.KubeApiClient('http://127.0.0.1:%d' % server.server_address[1],
+                                timeout=0.5)
+    yield server, client
+    server.release.set()
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_request_reconnects_after_keep_alive_close(api):
+    server, client = api
+    server.actions[:] = ['close']
+    assert client.request('GET', '/api/v1/pods') == {}
+    # the connection was closed after the GET, so the POST is sent again
+    assert client.request('POST', '/api/v1/pods', {}) == {}
+    assert server.requests == ['GET', 'POST']
+
+
+def test_request_not_resent_after_timeout(api):
+    server, client = api
+    server.actions[:] = ['answer', 'hang']
+    assert client.request('GET', '/api/v1/pods') == {}
+    with pytest.raises(socket.timeout):
+        client.request('DELETE', '/api/v1/namespaces/default/pods/p')
+    assert server.requests == ['GET', 'DELETE']
+
+
+def test_request_not_resent_on_new_connection(api):
+    server, client = api
+    server.actions[:] = ['drop']
+    with pytest.raises(Exception) as info:
+        client.request('POST', '/api/v1/pods', {})
+    assert kube.closed_by_server(info.value)
+    assert server.requests == ['POST']
+
+
+class Failed(Exception):
+    pass
+
+
+class FakeModule(object):
+    """Stands in for AnsibleModule: kubectl runs return the queued
+    (rc, stdout, stderr) outputs in turn and fail_json raises Failed."""
+
+    def __init__(self, outputs=(), **params):
+        self.params = params
+        self.outputs = list(outputs)
+        self.commands = []
+
+    def get_bin_path(self, name, required=False):
+        return name
+
+    def run_command(self, args):
+        self.commands.append(args)
+        return self.outputs.pop(0)
+
+    def fail_json(self, **result):
+        raise Failed(result)
+
+
+class TerminatingClient(object):
+    """Records requests; the object stays until it was read `lingers` times
+    after its deletion, like a pod that terminates gracefully."""
+
+    def __init__(self, lingers):
+        self.lingers = lingers
+        self.requests = []
+
+    def request(self, method, path, body=None, params=None):
+        self.requests.append(method)
+        if method == 'GET':
+            if self.lingers == 0:
+                raise kube.KubeApiError(method, path, 404, 'not found')
+            self.lingers -= 1
+            return {'metadata': {'deletionTimestamp': 'now'}}
+        return {}
+
+
+def _api_manager(client, **params):
+    manager = kube.KubeApiManager.__new__(kube.KubeApiManager)
+    manager.module = FakeModule(**params)
+    manager.client = client
+    manager._listings = {}
+    return manager
+
+
+def test_recreate_waits_until_deleted(monkeypatch):
+    monkeypatch.setattr(kube.time, 'sleep', lambda seconds: None)
+    client = TerminatingClient(lingers=3)
+    _api_manager(client, wait_timeout=60)._recreate(
+        '/api/v1/namespaces/default/pods/p', {'metadata': {'name': 'p'}})
+    assert client.requests == ['DELETE', 'GET', 'GET', 'GET', 'GET', 'POST']
+
+
+def test_recreate_times_out(monkeypatch):
+    monkeypatch.setattr(kube.time, 'sleep', lambda seconds: None)
+    client = TerminatingClient(lingers=1000)
+    with pytest.raises(kube.KubeApiError) as info:
+        _api_manager(client, wait_timeout=0)._recreate(
+            '/api/v1/namespaces/default/pods/p', {'metadata': {'name': 'p'}})
+    assert info.value.status == 409
+    assert 'POST' not in client.requests
+
+
+class WatchingClient(object):
+    """Answers each listing and watch of a collection with the next of the
+    given listings and event streams, recording the parameters."""
+
+    def __init__(self, listings, watches):
+        self.listings = list(listings)
+        self.watches = list(watches)
+        self.calls = []
+
+    def request(self, method, path, body=None, params=None):
+        self.calls.append(('list', dict(params)))
+        items, version = self.listings.pop(0)
+        return {'metadata': {'resourceVersion': version}, 'items': items}
+
+    def watch(self, path, params, timeout):
+        self.calls.append(('watch', dict(params)))
+        for event in self.watches.pop(0):
+            yield event
+
+
+def _pod(name, is_ready=True):
+    return {'metadata': {'name': name},
+            'status': _conditions(Ready='True' if is_ready else 'False')}
+
+
+def _wait(client, pending):
+    _api_manager(client)._wait_collection('/api/v1/namespaces/default/pods', pending,
+                                          kube.time.time() + 60)
+
+
+def test_wait_collection_ready_when_listed():
+    pending = {'a': ('Pod', False), 'b': ('Pod', False)}
+    client = WatchingClient([([_pod('a'), _pod('b')], '10')], [])
+    _wait(client, pending)
+    assert pending == {}
+    # several names are not narrowed down by a field selector
+    assert client.calls == [('list', {})]
+
+
+def test_wait_collection_watches_from_listing():
+    pending = {'a': ('Pod', False), 'gone': ('Pod', True)}
+    client = WatchingClient(
+        [([_pod('a', is_ready=False), _pod('gone')], '10')],
+        [[{'type': 'BOOKMARK', 'object': {'metadata': {'resourceVersion': '11'}}},
+          {'type': 'MODIFIED', 'object': _pod('a')},
+          {'type': 'MODIFIED', 'object': _pod('other')},
+          {'type': 'DELETED', 'object': _pod('gone')},
+          {'type': 'MODIFIED', 'object': _pod('a', is_ready=False)}]])
+    _wait(client, pending)
+    assert pending == {}
+    assert [call for call, _ in client.calls] == ['list', 'watch']
+    assert client.calls[1][1]['resourceVersion'] == '10'
+
+
+def test_wait_collection_deleted_when_not_listed():
+    pending = {'gone': ('Pod', True)}
+    client = WatchingClient([([], '10')], [])
+    _wait(client, pending)
+    assert pending == {}
+    assert client.calls == [('list', {'fieldSelector': 'metadata.name=gone'})]
+
+
+def test_wait_collection_relists_after_error():
+    pending = {'a': ('Pod', False)}
+    expired = {'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410,
+                                           'reason': 'Expired'}}
+    client = WatchingClient(
+        [([_pod('a', is_ready=False)], '10'), ([_pod('a', is_ready=False)], '20')],
+        [[expired, {'type': 'MODIFIED', 'object': _pod('a')}],
+         [{'type': 'MODIFIED', 'object': _pod('a')}]])
+    _wait(client, pending)
+    assert pending == {}
+    assert [(call, params.get('resourceVersion')) for call, params in client.calls] == \
+        [('list', None), ('watch', '10'), ('list', None), ('watch', '20')]
+    assert all(params['fieldSelector'] == 'metadata.name=a' for _, params in client.calls)
+
+
+FILES = ['ns.yml', 'addons/dns.json']
+
+
+def _apply_all(state, *outputs, **params):
+    module = FakeModule(outputs, filename=FILES, **params)
+    return module, kube.KubeManager(module).apply_all(state)
+
+
+def _summary(results):
+    return [(result['kind'], result['name'], result['changed'], result['failed'])
+            for result in results]
+
+
+def test_apply_all_current_output():
+    module, results = _apply_all('present', (
+        0, 'namespace/kube-system created\ndeployment.apps/dns created\n', ''))
+    assert module.commands == [['kubectl', 'create', '--filename=ns.yml',
+                                '--filename=addons/dns.json']]
+    assert _summary(results) == [('namespace', 'kube-system', True, False),
+                                 ('deployment.apps', 'dns', True, False)]
+    assert results[1]['msg'] == 'deployment.apps "dns" created'
+
+
+def test_apply_all_older_output():
+    _, results = _apply_all('absent', (
+        0, 'namespace "kube-system" deleted\nreplicationcontroller "dash" deleted\n', ''))
+    assert _summary(results) == [('namespace', 'kube-system', True, False),
+                                 ('replicationcontroller', 'dash', True, False)]
+
+
+def test_apply_all_expected_errors():
+    module, results = _apply_all('present', (
+        1, 'namespace/kube-system created\n',
+        'Error from server (AlreadyExists): error when creating "addons/dns.json": '
+        'deployments.apps "dns" already exists\n'))
+    assert _summary(results) == [('namespace', 'kube-system', True, False),
+                                 ('deployments.apps', 'dns', False, False)]
+    assert results[1]['filename'] == 'addons/dns.json'
+
+    _, results = _apply_all('reloaded', (
+        1, '', 'Error from server (NotFound): error when replacing "ns.yml": '
+               'namespaces "kube-system" not found\n'))
+    assert _summary(results) == [('namespaces', 'kube-system', False, False)]
+
+
+def test_apply_all_unexpected_errors():
+    # AlreadyExists is only expected for state=present
+    _, results = _apply_all('reloaded', (
+        1, '', 'Error from server (NotFound): error when replacing "ns.yml": '
+               'namespaces "kube-system" not found\n'), force=True)
+    assert _summary(results) == [('namespaces', 'kube-system', False, True)]
+    assert results[0]['msg'] == 'namespaces "kube-system" not found'
+
+    _, results = _apply_all('latest', (1, 'diff -u -N /tmp/LIVE-1/v1.Namespace..x x\n', ''), (
+        1, 'namespace/x serverside-applied\n',
+        'for: "addons/dns.json": deployments.apps "dns" is invalid: spec: Required value\n'))
+    assert _summary(results) == [('namespace', 'x', True, False),
+                                 ('deployments.apps', 'dns', False, True)]
+
+
+@pytest.mark.parametrize('err', [
+    'error: unable to recognize "addons/x.yml": no matches for kind "Foo"\n',
+    '',
+])
+def test_apply_all_unparsed_errors(err):
+    # a matched expected error does not excuse a line that was not matched
+    with pytest.raises(Failed) as info:
+        _apply_all('present', (
+            1, 'namespace/kube-system created\n',
+            'Error from server (AlreadyExists): error when creating "addons/dns.json": '
+            'deployments.apps "dns" already exists\n' * bool(err) + err))
+    result = info.value.args[0]
+    assert 'rc=1' in result['msg']
+    assert err.strip() in result['msg']
+    assert 'already exists' not in result['msg']
+    assert result['changed'] is True
+    assert _summary(result['results'])[0] == ('namespace', 'kube-system', True, False)
+
+
+def test_apply_all_stopped_rejected():
+    with pytest.raises(Failed) as info:
+        _apply_all('stopped')
+    assert 'transport=api' in info.value.args[0]['msg']
+
+
+def _diff_line(target):
+    return 'diff -u -N /tmp/LIVE-123/%s /tmp/MERGED-456/%s' % (target, target)
+
+
+@pytest.mark.parametrize('target, difference', [
+    ('apps.v1.Deployment.kube-system.dns', ('deployment', 'dns')),
+    ('v1.Service.default.nginx', ('service', 'nginx')),
+    ('networking.k8s.io.v1.Ingress.default.web', ('ingress', 'web')),
+    ('example.com.v1alpha1.Widget.team-a.w', ('widget', 'w')),
+    # names may contain dots
+    ('v1.ConfigMap.default.app.config.v2', ('configmap', 'app.config.v2')),
+    # cluster-scoped objects have an empty namespace
+    ('v1.Namespace..kube-system', ('namespace', 'kube-system')),
+    ('rbac.authorization.k8s.io.v1.ClusterRole..system:aggregate.view',
+     ('clusterrole', 'system:aggregate.view')),
+])
+def test_diff_targets(target, difference):
+    module = FakeModule([(1, '%s\n--- /tmp/LIVE-123/%s\n+++ /tmp/MERGED-456/%s\n'
+                          '@@ -1 +1 @@\n-a\n+b\n' % (_diff_line(target), target, target),
+                          '')])
+    assert kube.KubeManager(module)._diff(['a.yml']) == set([difference])
+    assert module.commands == [['kubectl', 'diff'] + kube.APPLY_ARGS + ['--filename=a.yml']]
+
+
+def test_diff_several_targets():
+    out = '\n'.join([_diff_line('v1.Service.default.nginx'), '-a', '+b',
+                     _diff_line('apps.v1.Deployment.default.nginx'), '-c', '+d'])
+    module = FakeModule([(1, out, '')])
+    assert kube.KubeManager(module)._diff(['a.yml']) == \
+        set([('service', 'nginx'), ('deployment', 'nginx')])
+
+
+def test_diff_unchanged():
+    module = FakeModule([(0, '', '')])
+    assert kube.KubeManager(module)._diff(['a.yml']) == set()
+
+
+def test_diff_unattributed():
+    # an external diff program whose output names no files
+    module = FakeModule([(1, '1c1\n< a\n---\n> b\n', '')])
+    assert kube.KubeManager(module)._diff(['a.yml']) == set([(None, None)])
+
+
+def test_diff_error():
+    module = FakeModule([(2, '', 'error: the server could not find the resource\n')])
+    with pytest.raises(Failed) as info:
+        kube.KubeManager(module)._diff(['a.yml'])
+    assert 'could not find the resource' in info.value.args[0]['msg']
+
+
+@pytest.mark.parametrize('line, differences, differs', [
+    ('deployment.apps/dns serverside-applied', set([('deployment', 'dns')]), True),
+    ('service/dns serverside-applied', set([('deployment', 'dns')]), False),
+    ('deployment.apps/dns2 serverside-applied', set([('deployment', 'dns')]), False),
+    ('configmap/app.config.v2 serverside-applied', set([('configmap', 'app.config.v2')]),
+     True),
+    ('namespace "kube-system" configured', set([('namespace', 'kube-system')]), True),
+    ('service/dns serverside-applied', set([(None, None)]), True),
+])
+def test_differs(line, differences, differs):
+    match = kube.KUBECTL_RESULT.match(line)
+    assert kube.KubeManager._differs(match, differences) is differs
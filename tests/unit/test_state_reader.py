@@ -0,0 +1,174 @@
+"""
+StateReader from plugins/lib/terraform_inventory.py tokenizes state files
+itself so it can skip values without decoding them. These tests read the
+same documents with json and with StateReader split into chunks of every
+size, so every value is cut at every offset at least once.
+"""
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, os.pardir, 'plugins', 'lib'))
+
+import terraform_inventory as tf  # noqa: E402
+
+VALUES = [
+    '"plain"',
+    '""',
+    r'"quote \" backslash \\ slash \/ controls \b\f\n\r\t"',
+    r'"\\"',
+    r'"ends in escaped quote \""',
+    r'"é中 and a surrogate pair 😀"',
+    '"unescaped é中"',
+    '"brackets [{ ]} and , : inside"',
+    '0',
+    '-0',
+    '12345678901234567890',
+    '-1.5e3',
+    '1E+2',
+    '0.000001e-10',
+    'true',
+    'false',
+    'null',
+    '[]',
+    '{}',
+    '[[], {}, [[]], [{}], {"a": {}}, {"b": []}]',
+    '{"a": {"b": {"c": [[], {}]}}, "": ""}',
+    '[1, "two", [3, {"four": 4}], {"five": [5.5, null, true]}]',
+    '  [ 1 ,\n\t{ "k" : "v" } ]  ',
+]
+
+
+def _reader(text, chunk_size):
+    reader = tf.StateReader(io.StringIO(text))
+    reader.chunk_size = chunk_size
+    return reader
+
+
+def _chunk_sizes(text):
+    # a chunk of size n puts the first cut at offset n
+    return range(1, len(text) + 2)
+
+
+@pytest.mark.parametrize('text', VALUES)
+def test_read_value(text):
+    expected = json.loads(text)
+    for chunk_size in _chunk_sizes(text):
+        assert _reader(text, chunk_size).read_value() == expected, chunk_size
+
+
+@pytest.mark.parametrize('text', VALUES)
+def test_skip_value(text):
+    # skipping a value must leave the reader at the value after it
+    document = '[%s, "after"]' % text
+    for chunk_size in _chunk_sizes(document):
+        reader = _reader(document, chunk_size)
+        elements = reader.iterarray()
+        next(elements)
+        reader.skip_value()
+        next(elements)
+        assert reader.read_value() == 'after', chunk_size
+
+
+@pytest.mark.parametrize('text', VALUES)
+def test_iterobject(text):
+    document = '{"skipped": %s, "read": %s, "last": %s}' % (text, text, text)
+    expected = json.loads(document)
+    for chunk_size in _chunk_sizes(document):
+        reader = _reader(document, chunk_size)
+        got = {}
+        for key in reader.iterobject():
+            if key == 'skipped':
+                reader.skip_value()
+            else:
+                got[key] = reader.read_value()
+        assert got == {'read': expected['read'], 'last': expected['last']}, chunk_size
+
+
+@pytest.mark.parametrize('text', ['', '[', '{"a": ', '"unterminated', '[1, 2'])
+def test_truncated(text):
+    for chunk_size in _chunk_sizes(text):
+        with pytest.raises(ValueError):
+            _reader(text, chunk_size).read_value()
+
+
+def _random_string(rng):
+    return ''.join(rng.choice('ab"\\{}[]:, \né中\U0001f600')
+                   for _ in range(rng.randint(0, 12)))
+
+
+def _random_value(rng, depth=0):
+    roll = rng.random()
+    if depth > 3 or roll < 0.3:
+        return rng.choice([_random_string(rng), 12345, -1.5e3, 0.1, True, None, False, 0])
+    if roll < 0.6:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return dict((_random_string(rng), _random_value(rng, depth + 1))
+                for _ in range(rng.randint(0, 4)))
+
+
+def _legacy_state(rng):
+    modules = []
+    for index in range(rng.randint(0, 3)):
+        resources = {}
+        for number in range(rng.randint(0, 5)):
+            resource_type = rng.choice(['aws_instance', 'google_compute_instance',
+                                        'aws_security_group', 'data.x', 'noperiod'])
+            resources['%s.r%d%s' % (resource_type, number, _random_string(rng))] = \
+                _random_value(rng)
+        module = [('path', ['root', 'm%d' % index]), ('resources', resources),
+                  ('outputs', _random_value(rng))]
+        # resources may come before the path
+        rng.shuffle(module)
+        modules.append(dict(module))
+
+    state = {'version': 3, 'before': _random_value(rng), 'modules': modules,
+             'after': _random_value(rng)}
+    expected = [(module['path'][-1], name, resource)
+                for module in modules for name, resource in module['resources'].items()
+                if name.split('.', 1)[0] in tf.PARSERS]
+    return state, expected
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_legacy_resources(seed):
+    rng = random.Random(seed)
+    state, expected = _legacy_state(rng)
+    text = json.dumps(state, indent=rng.choice([None, 2]), ensure_ascii=rng.random() < 0.5)
+    for chunk_size in list(range(1, 60)) + [1 << 16]:
+        got = list(_reader(text, chunk_size).resources(tf.PARSERS))
+        assert sorted(map(repr, got)) == sorted(map(repr, expected)), chunk_size
+
+
+def test_v4_resources():
+    state = {
+        'version': 4,
+        'outputs': {'ip': {'value': '10.0.0.1', 'type': 'string'}},
+        'resources': [
+            {'mode': 'managed', 'type': 'aws_instance', 'name': 'web',
+             'module': 'module.control',
+             'instances': [
+                 {'index_key': 0, 'attributes': {'id': 'i-1', 'tags': {'role': 'control'}}},
+                 {'index_key': 1, 'deposed': 'abc', 'attributes': {'id': 'i-old'}},
+             ]},
+            {'mode': 'data', 'type': 'aws_instance', 'name': 'lookup',
+             'instances': [{'attributes': {'id': 'i-data'}}]},
+            {'mode': 'managed', 'type': 'null_resource', 'name': 'noise',
+             'instances': [{'attributes': {'id': '1', 'triggers': {'"[{': '}]'}}}]},
+        ],
+    }
+    text = json.dumps(state)
+    for chunk_size in _chunk_sizes(text):
+        reader = _reader(text, chunk_size)
+        got = [(module, key, resource['primary']['id'])
+               for module, key, resource in reader.resources(tf.PARSERS)]
+        assert got == [('control', 'aws_instance.web.0', 'i-1')], chunk_size
+        assert reader.decoded == {'aws_instance': 1}
+        assert reader.skipped == {'aws_instance': 1, 'null_resource': 1}
@@ -0,0 +1,169 @@
+"""
+The remote states of plugins/lib/terraform_inventory.py fetched from the
+local stand-in in testing/tfstate_server.py: a first fetch downloads the
+state, a repeated one is answered without a body until the state changes.
+"""
+from __future__ import unicode_literals
+
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, os.pardir, 'plugins', 'lib'))
+sys.path.insert(0, os.path.join(HERE, os.pardir, os.pardir, 'testing'))
+
+import terraform_inventory as tf  # noqa: E402
+import tfstate_server  # noqa: E402
+
+STATE = {'version': 3, 'modules': [{'path': ['root'], 'resources': {}}]}
+
+
+class Server(object):
+    def __init__(self, root):
+        self.root = root
+        self.requests = []
+
+    def start(self):
+        requests = self.requests
+
+        class Handler(tfstate_server.StateHandler):
+            root = self.root
+
+            def log_request(self, code='-', size='-'):
+                requests.append((self.command, self.path, str(int(code))))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = tfstate_server.ThreadingServer(('127.0.0.1', 0), Handler)
+        self.address = '127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def statuses(self):
+        return [status for _, _, status in self.requests]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def server(tmpdir):
+    root = tmpdir.mkdir('states')
+    root.join('terraform.tfstate').write(json.dumps(STATE))
+    # another user of the KV store, written after the state
+    _touch(str(root.mkdir('other').join('key')), 10)
+    server = Server(str(root))
+    server.start()
+    yield server
+    server.stop()
+
+
+def _touch(path, seconds):
+    '''write path with an mtime seconds ahead, moving the store's index'''
+    with open(path, 'w') as other_file:
+        other_file.write('x')
+    mtime = time.time() + seconds
+    os.utime(path, (mtime, mtime))
+
+
+def _change(path, state):
+    # the Consul index is the mtime in milliseconds, so make sure it moves
+    mtime = os.stat(path).st_mtime
+    with open(path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.utime(path, (mtime + 1, mtime + 1))
+
+
+def _load(source):
+    with open(source.path) as state_file:
+        return json.load(state_file)
+
+
+def test_http_fetch(server, tmpdir):
+    source = tf.remote_state('http://%s/terraform.tfstate' % server.address,
+                             str(tmpdir.join('cache')))
+    assert isinstance(source, tf.HttpState)
+
+    assert source.fetch() is True
+    assert _load(source) == STATE
+    assert server.statuses() == ['200']
+
+    # the ETag of the first download turns the second into a 304
+    assert source.fetch() is False
+    assert server.statuses() == ['200', '304']
+    assert _load(source) == STATE
+
+    changed = dict(STATE, serial=2)
+    _change(os.path.join(server.root, 'terraform.tfstate'), changed)
+    assert source.fetch() is True
+    assert server.statuses() == ['200', '304', '200']
+    assert _load(source) == changed
+
+
+def test_http_missing(server, tmpdir):
+    source = tf.remote_state('http://%s/missing.tfstate' % server.address,
+                             str(tmpdir.join('cache')))
+    with pytest.raises(IOError):
+        source.fetch()
+    assert not os.path.exists(source.path)
+
+
+def test_consul_fetch(server, tmpdir):
+    source = tf.remote_state('consul://%s/terraform.tfstate' % server.address,
+                             str(tmpdir.join('cache')))
+    assert isinstance(source, tf.ConsulState)
+
+    assert source.fetch() is True
+    assert _load(source) == STATE
+    assert [path for _, path, _ in server.requests] == \
+        ['/v1/kv/terraform.tfstate?keys=', '/v1/kv/terraform.tfstate?raw=']
+
+    # an unchanged index only costs a ?keys request, however much the rest
+    # of the store changes
+    _touch(os.path.join(server.root, 'other', 'key'), 20)
+    assert source.fetch() is False
+    assert [path for _, path, _ in server.requests[2:]] == \
+        ['/v1/kv/terraform.tfstate?keys=']
+
+    changed = dict(STATE, serial=2)
+    _change(os.path.join(server.root, 'terraform.tfstate'), changed)
+    assert source.fetch() is True
+    assert [path for _, path, _ in server.requests[3:]] == \
+        ['/v1/kv/terraform.tfstate?keys=', '/v1/kv/terraform.tfstate?raw=']
+    assert _load(source) == changed
+    assert source.fetch() is False
+
+
+def test_consul_blocking_fetch(server, tmpdir):
+    source = tf.remote_state('consul://%s/terraform.tfstate' % server.address,
+                             str(tmpdir.join('cache')))
+    assert source.fetch() is True
+
+    # a blocking query with only other keys changing returns after the wait
+    start = time.time()
+    timer = threading.Timer(0.1, _touch,
+                            (os.path.join(server.root, 'other', 'key'), 20))
+    timer.start()
+    try:
+        assert source.fetch(wait='300ms') is False
+    finally:
+        timer.join()
+    assert time.time() - start >= 0.3
+
+    changed = dict(STATE, serial=2)
+    timer = threading.Timer(0.2, _change, (os.path.join(server.root, 'terraform.tfstate'),
+                                           changed))
+    timer.start()
+    try:
+        assert source.fetch(wait='5s') is True
+    finally:
+        timer.join()
+    assert _load(source) == changed